@@ -0,0 +1,433 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import utils
+
+
+def count_pairs(x, y):
+    '''
+    Counts the number of occurrences of each distinct (x, y) pair.
+    The pairs are packed into a structured array so that a single call to
+    np.unique does the counting in C instead of a Python dict.
+
+    :x: the x values
+    :y: the y values
+    :return: the distinct x values, the distinct y values and their counts
+    '''
+    x = utils.as_array(x)
+    y = utils.as_array(y)
+    if len(x) != len(y):
+        raise ValueError('x and y must have the same length.')
+    pairs = np.empty(len(x), dtype=[('x', x.dtype), ('y', y.dtype)])
+    pairs['x'] = x
+    pairs['y'] = y
+    unique, counts = np.unique(pairs, return_counts=True)
+    return unique['x'], unique['y'], counts
+
+
+def _symlog(values):
+    return np.sign(values) * np.log1p(np.abs(values))
+
+
+def _symexp(values):
+    return np.sign(values) * np.expm1(np.abs(values))
+
+
+def _bin_index(values, bins, log):
+    '''
+    Maps each value to one of `bins` equal-width bins, measured in log space
+    (sign(v) * log(1 + |v|), which also handles zeros and negatives) if log is set.
+
+    :return: the bin index of every value and the centers of the bins
+    '''
+    t = _symlog(values) if log else values.astype(float)
+    lo, hi = np.min(t), np.max(t)
+    if hi == lo: # a single distinct value gets a bin of its own
+        hi = lo + 1.
+    width = (hi - lo) / bins
+    index = ((t - lo) / width).astype(np.intp)
+    np.clip(index, 0, bins - 1, out=index)
+    centers = lo + (np.arange(bins) + 0.5) * width
+    if log:
+        centers = _symexp(centers)
+    return index, centers
+
+
+def bin_pairs(x, y, bins=200, log=False, weights=None):
+    '''
+    Aggregates (x, y) points onto a bins x bins grid, counting the points in each cell.
+    Only occupied cells are returned, so the result has at most bins ** 2 entries
+    no matter how many points there are.
+
+    :x: the x values
+    :y: the y values
+    :bins: the grid resolution along each axis
+    :log: if True, the cells are equal width in log space instead of linear space
+    :weights: the number of times each (x, y) point occurs, if the points are already counted
+    :return: the x and y centers of the occupied cells and the number of points in each
+    '''
+    x = utils.as_array(x)
+    y = utils.as_array(y)
+    if len(x) != len(y):
+        raise ValueError('x and y must have the same length.')
+    if len(x) == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.intp)
+    ix, x_centers = _bin_index(x, bins, log)
+    iy, y_centers = _bin_index(y, bins, log)
+    counts = np.bincount(ix * bins + iy, weights=weights, minlength=bins * bins)
+    if weights is not None:
+        counts = counts.astype(np.int64)
+    occupied = np.flatnonzero(counts)
+    return x_centers[occupied // bins], y_centers[occupied % bins], counts[occupied]
+
+
+def merge_counts(values_a, counts_a, values_b, counts_b):
+    '''
+    Merges two sets of (distinct value, count) arrays into one.
+
+    :return: the sorted distinct values of both sets and their summed counts
+    '''
+    values, inverse = np.unique(np.concatenate([values_a, values_b]), return_inverse=True)
+    counts = np.zeros(len(values), dtype=np.int64)
+    np.add.at(counts, inverse, np.concatenate([counts_a, counts_b]))
+    return values, counts
+
+
+def value_counts(values, counts):
+    '''
+    Normalizes a (value, count) table: the values are sorted, repeated values are merged
+    and values with a count of 0 are dropped. Tables that are already normalized are returned
+    as they are, so this only costs a pass over the table.
+
+    :return: the sorted distinct values and their counts
+    '''
+    values, counts = utils.as_array(values).ravel(), utils.as_array(counts).ravel()
+    if len(values) != len(counts):
+        raise ValueError('There must be one count for each value.')
+    if np.any(counts == 0):
+        present = counts != 0
+        values, counts = values[present], counts[present]
+    if np.all(values[1:] > values[:-1]):
+        return values, counts
+    values, inverse = np.unique(values, return_inverse=True)
+    return values, np.bincount(inverse.ravel(), weights=counts, minlength=len(values)).astype(counts.dtype)
+
+
+def iter_value_chunks(data, chunk_size=1 << 20):
+    '''
+    Yields data as a sequence of 1-d NumPy chunks. data can be an array, memmap, Arrow or
+    pandas column or list, any iterable (e.g. a generator reading a log file) that yields
+    either single values or NumPy chunks, or a callable that returns one of these.
+
+    :chunk_size: the maximum length of the chunks cut from columns and of the chunks
+                 that single values are buffered into
+    '''
+    if callable(data):
+        data = data()
+    if isinstance(data, (list, tuple)) and not (data and utils.is_column(data[0])):
+        data = np.asarray(data)
+    if utils.is_column(data):
+        yield from utils.iter_chunks(data, chunk_size)
+        return
+    buffer = list()
+    for item in data:
+        if utils.is_column(item) or np.ndim(item) > 0:
+            yield utils.as_array(item).ravel()
+        else:
+            buffer.append(item)
+            if len(buffer) >= chunk_size:
+                yield np.asarray(buffer)
+                buffer = list()
+    if buffer:
+        yield np.asarray(buffer)
+
+
+def count_values(data, chunk_size=1 << 20):
+    '''
+    Counts the number of occurrences of each distinct value in data in a single pass.
+    data can be anything iter_value_chunks accepts. Large columns and iterables are consumed
+    chunk by chunk, so memory is bounded by the chunk size plus the number of distinct values.
+
+    :data: the values to count
+    :chunk_size: how many values to count at a time
+    :return: the sorted distinct values and their counts
+    '''
+    if isinstance(data, (list, tuple)) and not (data and utils.is_column(data[0])):
+        data = np.asarray(data)
+    if utils.is_column(data) and not utils.is_chunked(data) and len(data) <= chunk_size:
+        return np.unique(utils.as_array(data), return_counts=True)
+    values, counts = None, None
+    for chunk in iter_value_chunks(data, chunk_size):
+        chunk_values, chunk_counts = np.unique(chunk, return_counts=True)
+        if values is None:
+            values, counts = chunk_values, chunk_counts
+        else:
+            values, counts = merge_counts(values, counts, chunk_values, chunk_counts)
+    if values is None:
+        return np.unique(np.empty(0), return_counts=True)
+    return values, counts
+
+
+# how many evenly spaced values rank_points looks at to tell repeated values from continuous ones
+_REPETITION_SAMPLE = 1 << 16
+
+
+def rank_points(values, decimate=None, max_points=2000, log=True, counts=None):
+    '''
+    Computes the (rank, value) points of a rank plot, from largest to smallest.
+    Ranks are 0-based positions, matching plotting the sorted values directly.
+
+    :values: the values to rank
+    :decimate: None for every rank (exact), 'log' for ranks spaced evenly in log space
+               or 'pixel' for ranks spaced evenly along the axis (log if log else linear)
+    :max_points: the maximum number of ranks to keep when decimating
+    :log: whether the rank axis is logarithmic (only used by 'pixel')
+    :counts: the number of times each value occurs, if values is a (value, count) table
+    :return: the ranks and their values
+    '''
+    if counts is None and decimate and utils.is_chunked(values):
+        # memmaps and chunked columns are counted chunk by chunk instead of copied for sorting
+        values, counts = count_values(values)
+    elif counts is not None:
+        values, counts = value_counts(values, counts)
+    if counts is not None:
+        n = int(np.sum(counts))
+        if decimate and n > max_points:
+            ranks = decimated_ranks(n, decimate, max_points, log)
+            return ranks, ranked_values(values, counts, ranks)
+        return np.arange(n), np.repeat(values[::-1], counts[::-1])
+    values = utils.as_array(values).ravel()
+    n = len(values)
+    if not decimate or n <= max_points:
+        return np.arange(n), np.sort(values)[::-1]
+    ranks = decimated_ranks(n, decimate, max_points, log)
+    # values that repeat a lot (counts, degrees, scores, ...) are counted instead of sorted, so
+    # only their distinct values are ordered; they are told apart by how few values of an evenly
+    # spaced sample occur only once. Continuous values are sorted, since np.partition with this
+    # many kth indices is several times slower than NumPy's sort.
+    sample_counts = np.unique(values[::max(1, n // _REPETITION_SAMPLE)], return_counts=True)[1]
+    if np.count_nonzero(sample_counts == 1) <= np.sum(sample_counts) // 64:
+        distinct, counts = count_values(values)
+        return ranks, ranked_values(distinct, counts, ranks)
+    # the value at descending rank r is the (n - 1 - r)-th smallest value
+    return ranks, np.sort(values)[n - 1 - ranks]
+
+
+def decimated_ranks(n, decimate, max_points, log=True):
+    '''
+    :return: about max_points of the ranks 0, ..., n - 1 (always including 0), spaced as rank_points describes
+    '''
+    if decimate == 'log' or (decimate == 'pixel' and log):
+        ranks = np.geomspace(1, n - 1, max_points - 1)
+    elif decimate == 'pixel':
+        ranks = np.linspace(1, n - 1, max_points - 1)
+    else:
+        raise ValueError('decimate should be None, \'log\' or \'pixel\'.')
+    return np.unique(np.concatenate([[0], np.round(ranks).astype(np.intp)]))
+
+
+def ranked_values(values, counts, ranks):
+    '''
+    Looks up the values at the given descending ranks from distinct values and their counts,
+    as if the values had been repeated count times and sorted from largest to smallest.
+
+    :values: the distinct values, sorted in increasing order
+    :counts: the number of times each value occurs
+    :ranks: 0-based descending ranks
+    '''
+    cumulative = np.cumsum(counts[::-1])
+    return values[::-1][np.searchsorted(cumulative, ranks, side='right')]
+
+
+
+class TimelineCounts:
+    '''
+    Counts events per time bin over a horizon [start, t] with a fixed number of bins,
+    so that a timeline costs the same to draw whatever its length or number of events.
+    Each bin covers `width` consecutive time steps. New events can be added at any
+    time, and adding events past t grows the horizon by merging pairs of bins.
+    '''
+    def __init__(self, t, start=1, bins=1000):
+        self.start = start
+        self.t = t
+        self.bins = bins
+        self.width = max(1, int(np.ceil((t - start + 1) / bins)))
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def add(self, events):
+        '''
+        Adds events (an array or list of times), ignoring the ones before start.
+
+        :return: this TimelineCounts
+        '''
+        events = utils.as_array(events).ravel()
+        events = events[events >= self.start]
+        if len(events) == 0:
+            return self
+        last = np.max(events)
+        if last > self.t:
+            self.extend(last)
+        index = ((events - self.start) // self.width).astype(np.intp)
+        self.counts += np.bincount(index, minlength=self.bins)
+        return self
+
+    def extend(self, t):
+        '''
+        Grows the horizon to t, doubling the width of the bins as often as needed.
+        '''
+        while self.start + self.bins * self.width <= t:
+            counts = np.append(self.counts, 0) if self.bins % 2 else self.counts
+            merged = counts[0::2] + counts[1::2]
+            self.counts = np.concatenate([merged, np.zeros(self.bins - len(merged), dtype=np.int64)])
+            self.width *= 2
+        self.t = max(self.t, t)
+
+    def centers(self):
+        '''
+        :return: the time at the middle of each bin
+        '''
+        return self.start + (np.arange(self.bins) + 0.5) * self.width - 0.5
+
+
+def block_sum(matrix, max_cells):
+    '''
+    Sums a dense or scipy.sparse matrix over square blocks of factor x factor cells, with
+    factor chosen so that neither side of the result has more than max_cells cells.
+    Sparse matrices are summed from their nonzero entries without being made dense.
+
+    :return: the dense summed matrix and the factor
+    '''
+    rows, cols = matrix.shape
+    factor = max(1, int(np.ceil(max(rows, cols) / max_cells)))
+    out_rows, out_cols = -(-rows // factor), -(-cols // factor)
+    if hasattr(matrix, 'tocoo'):
+        coo = matrix.tocoo()
+        cells = (coo.row // factor) * out_cols + coo.col // factor
+        grid = np.bincount(cells, weights=coo.data, minlength=out_rows * out_cols)
+        return grid.reshape(out_rows, out_cols), factor
+    matrix = np.asarray(matrix, dtype=float)
+    if factor == 1:
+        return matrix, factor
+    padded = np.zeros((out_rows * factor, out_cols * factor))
+    padded[:rows, :cols] = matrix
+    return padded.reshape(out_rows, factor, out_cols, factor).sum(axis=(1, 3)), factor
+
+
+def histogram_edges(sources, bins=10, bin_range=None, quantiles=False, sample_size=100000, chunk_size=1 << 20,
+                    weights=None):
+    '''
+    Computes one set of bin edges shared by all the sources, in a single pass over them.
+
+    :sources: a list of series, each anything iter_value_chunks accepts; unless bin_range is
+              given, they are read twice (once here and once to count), so single-use
+              iterators should be wrapped in a callable that returns a fresh one
+    :bins: the number of bins, or the bin edges themselves
+    :bin_range: the (lowest, highest) edges; defaults to the range of all the values
+    :quantiles: if True, the edges are placed at quantiles of all the values (estimated from
+                a uniform random sample of sample_size values), so every bin holds about as
+                many values, instead of being equally wide
+    :weights: the counts of every source, one array per source, if the sources are (value, count)
+              tables; quantiles are then exact instead of estimated
+    :return: the bin edges
+    '''
+    if np.ndim(bins) > 0:
+        return np.asarray(bins, dtype=float)
+    if bin_range is not None and not quantiles:
+        return np.linspace(bin_range[0], bin_range[1], bins + 1)
+    if weights is not None:
+        return _weighted_edges(sources, weights, bins, bin_range, quantiles)
+    lo, hi = np.inf, -np.inf
+    rng = np.random.default_rng(0)
+    sample, keys = np.empty(0), np.empty(0)
+    for source in sources:
+        if not callable(source) and iter(source) is source:
+            raise ValueError('Pass bin_range (or a callable returning the chunks) to histogram a single-use iterator.')
+        for chunk in iter_value_chunks(source, chunk_size):
+            chunk = chunk[np.isfinite(chunk)]
+            if len(chunk) == 0:
+                continue
+            lo, hi = min(lo, np.min(chunk)), max(hi, np.max(chunk))
+            if quantiles:
+                # keep the values with the smallest random keys, a uniform sample of everything seen so far
+                sample = np.concatenate([sample, chunk])
+                keys = np.concatenate([keys, rng.random(len(chunk))])
+                if len(sample) > sample_size:
+                    keep = np.argpartition(keys, sample_size)[:sample_size]
+                    sample, keys = sample[keep], keys[keep]
+    if bin_range is not None:
+        lo, hi = bin_range
+    elif lo > hi: # no values at all
+        lo, hi = 0., 1.
+    elif lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    if quantiles and len(sample):
+        edges = np.quantile(sample, np.linspace(0, 1, bins + 1))
+        edges[0], edges[-1] = lo, hi
+        return np.unique(edges)
+    return np.linspace(lo, hi, bins + 1)
+
+
+def _weighted_edges(sources, weights, bins, bin_range, quantiles):
+    values, counts = value_counts(np.concatenate([utils.as_array(source).ravel() for source in sources]),
+                                  np.concatenate([utils.as_array(w).ravel() for w in weights]))
+    finite = np.isfinite(values)
+    values, counts = values[finite], counts[finite]
+    if bin_range is not None:
+        lo, hi = bin_range
+    elif len(values) == 0:
+        lo, hi = 0., 1.
+    elif values[0] == values[-1]:
+        lo, hi = values[0] - 0.5, values[-1] + 0.5
+    else:
+        lo, hi = values[0], values[-1]
+    if quantiles and len(values):
+        # the value below which each fraction of the total count lies
+        cumulative = np.cumsum(counts)
+        ranks = np.linspace(0, 1, bins + 1) * (cumulative[-1] - 1)
+        edges = values[np.searchsorted(cumulative, ranks, side='right')].astype(float)
+        edges[0], edges[-1] = lo, hi
+        return np.unique(edges)
+    return np.linspace(lo, hi, bins + 1)
+
+
+def histogram_counts(source, edges, workers=None, chunk_size=1 << 20, weights=None):
+    '''
+    Counts the values of source in each bin, chunk by chunk, so that memory stays bounded by
+    the chunk size. Like np.histogram, values outside the edges are ignored.
+
+    :source: anything iter_value_chunks accepts
+    :edges: the bin edges (e.g. from histogram_edges)
+    :workers: if more than 1, chunks are counted by this many threads at once
+    :weights: the count of each value, if source is a (value, count) table
+    :return: the number of values in each bin
+    '''
+    edges = np.asarray(edges, dtype=float)
+    widths = np.diff(edges)
+    if np.array_equal(edges, np.linspace(edges[0], edges[-1], len(edges))):
+        # equal widths (the edges np.histogram would make itself) let np.histogram compute bin indices directly instead of searching
+        bins, bin_range = len(widths), (edges[0], edges[-1])
+    else:
+        bins, bin_range = edges, None
+    if weights is not None:
+        weights = utils.as_array(weights).ravel()
+        counts = np.histogram(utils.as_array(source).ravel(), bins=bins, range=bin_range, weights=weights)[0]
+        return counts.astype(np.int64) if weights.dtype.kind in 'iub' else counts
+    def count(chunk):
+        return np.histogram(chunk, bins=bins, range=bin_range)[0]
+    counts = np.zeros(len(widths), dtype=np.int64)
+    chunks = iter_value_chunks(source, chunk_size)
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = list()
+            for chunk in chunks:
+                pending.append(pool.submit(count, chunk))
+                # keep a bounded number of chunks in flight
+                if len(pending) >= 2 * workers:
+                    counts += pending.pop(0).result()
+            for future in pending:
+                counts += future.result()
+    else:
+        for chunk in chunks:
+            counts += count(chunk)
+    return counts
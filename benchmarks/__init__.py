@@ -0,0 +1,5 @@
+'''
+Benchmarks for plotauthority. Each module can be run on its own, e.g.
+
+    python -m benchmarks.import_time
+'''
@@ -0,0 +1,48 @@
+'''
+Compares the per-chart latency of building a new figure for every chart with reusing
+pooled figure templates (Plotter(reuse_figures=True)), with and without encoding a PNG.
+
+    python -m benchmarks.figure_pool [--charts 200] [--points 1000] [--dpi 100]
+'''
+import argparse
+import io
+import statistics
+import time
+
+import numpy as np
+
+from plotter import Plotter
+
+
+def time_charts(plotter, data, charts, dpi=None):
+    '''
+    :return: the latency of every chart in seconds
+    '''
+    times = list()
+    for i in range(charts):
+        start = time.perf_counter()
+        fig = plotter.pdf(data, title='chart {}'.format(i))
+        if dpi:
+            fig.savefig(io.BytesIO(), format='png', dpi=dpi)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--charts', type=int, default=200)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--dpi', type=int, default=100)
+    args = parser.parse_args()
+
+    data = np.random.default_rng(0).zipf(2, args.points)
+    for dpi, phase in ((None, 'build only'), (args.dpi, 'build + png at {} dpi'.format(args.dpi))):
+        for name, plotter in (('new figure', Plotter(pyplot=False)),
+                              ('pooled', Plotter(pyplot=False, reuse_figures=True))):
+            times = time_charts(plotter, data, args.charts, dpi)
+            print('{:<24} {:<12} median {:7.2f} ms  p90 {:7.2f} ms'.format(
+                phase, name, 1000 * statistics.median(times), 1000 * np.percentile(times, 90)))
+
+
+if __name__ == '__main__':
+    main()
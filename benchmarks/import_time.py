@@ -0,0 +1,61 @@
+'''
+Measures how long it takes to import plotter and construct a Plotter in a fresh interpreter,
+and fails if it takes longer than the budget or if it loads matplotlib or seaborn
+(both should only be imported once something is drawn).
+
+    python -m benchmarks.import_time [--runs 5] [--budget 0.5]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import plotter
+plotter.Plotter()
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(m for m in ('matplotlib', 'seaborn') if m in sys.modules))
+'''
+
+
+def measure(runs=5):
+    '''
+    :return: the import + construction time of every run, and the heavy modules that got loaded
+    '''
+    times = list()
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', SCRIPT], cwd=ROOT, check=True,
+                             capture_output=True, text=True).stdout.split()
+        times.append(float(out[0]))
+        if len(out) > 1:
+            loaded.update(out[1].split(','))
+    return times, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.5, help='maximum median time in seconds')
+    args = parser.parse_args()
+
+    times, loaded = measure(args.runs)
+    median = statistics.median(times)
+    print('import plotter + Plotter(): median {:.3f}s, min {:.3f}s over {} runs'.format(median, min(times), args.runs))
+    ok = True
+    if loaded:
+        print('FAIL: importing plotter loaded {}'.format(', '.join(sorted(loaded))))
+        ok = False
+    if median > args.budget:
+        print('FAIL: median is over the budget of {:.3f}s'.format(args.budget))
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+'''
+Times the Plotter methods across data sizes, headless on Agg.
+
+For every case and size it records the time of the data aggregation on its own, the time of
+the whole call (aggregation, drawing and encoding a PNG in memory) and the peak memory
+allocated during the call. Results are written as JSON so that runs on different commits can
+be compared, and --compare flags the cases that got slower or bigger.
+
+    python -m benchmarks.suite --out before.json
+    python -m benchmarks.suite --out after.json --compare before.json [--threshold 1.25]
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import aggregation
+from plotter import Plotter
+
+# exact rank plots draw one marker per value, so they are only run up to this size
+MAX_EXACT_RANK = 10 ** 6
+
+
+def _labels(rng, n, classes=20):
+    true = rng.integers(0, classes, n)
+    noise = rng.random(n) < 0.2
+    pred = np.where(noise, rng.integers(0, classes, n), true)
+    return true, pred
+
+
+def _confusion(labels, classes=20):
+    true, pred = labels
+    return np.bincount(true * classes + pred, minlength=classes * classes).reshape(classes, classes)
+
+
+# name -> (make data, aggregate, plot, largest size to run)
+CASES = {
+    'density_scatter': (lambda rng, n: (rng.zipf(2, n), rng.zipf(2, n)),
+                        lambda d: aggregation.count_pairs(*d),
+                        lambda p, d: p.density_scatter(*d, dpi=100),
+                        None),
+    'density_scatter_binned': (lambda rng, n: (rng.zipf(2, n), rng.zipf(2, n)),
+                               lambda d: aggregation.bin_pairs(*d, bins=200, log=True),
+                               lambda p, d: p.density_scatter(*d, bins=200, dpi=100),
+                               None),
+    'pdf': (lambda rng, n: rng.zipf(2, n),
+            aggregation.count_values,
+            lambda p, d: p.pdf(d, dpi=100),
+            None),
+    'pareto': (lambda rng, n: rng.zipf(2, n),
+               aggregation.count_values,
+               lambda p, d: p.pareto(d, dpi=100),
+               None),
+    'rank': (lambda rng, n: rng.zipf(2, n),
+             aggregation.rank_points,
+             lambda p, d: p.rank(d, dpi=100),
+             MAX_EXACT_RANK),
+    'rank_decimated': (lambda rng, n: rng.zipf(2, n),
+                       lambda d: aggregation.rank_points(d, decimate='log'),
+                       lambda p, d: p.rank(d, decimate='log', dpi=100),
+                       None),
+    'multi_histogram': (lambda rng, n: [rng.normal(0, 1, n // 2), rng.normal(1, 1, n // 2)],
+                        lambda d: [aggregation.histogram_counts(values, aggregation.histogram_edges(d, 10)) for values in d],
+                        lambda p, d: p.multi_histogram(d, dpi=100),
+                        None),
+    'confusion_matrix': (_labels,
+                         _confusion,
+                         lambda p, d: p.confusion_matrix(_confusion(d), dpi=100),
+                         None),
+    'timeline': (lambda rng, n: rng.integers(1, 10 ** 6, n),
+                 lambda d: aggregation.TimelineCounts(10 ** 6, bins=1500).add(d),
+                 lambda p, d: p.timeline(d, 10 ** 6, bins=1500, dpi=100),
+                 None),
+}
+
+
+def _best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(cases, sizes, repeat=3, seed=0):
+    '''
+    :return: a list of result dicts, one per (case, size)
+    '''
+    plotter = Plotter(pyplot=False, output='png')
+    plotter.pdf([1, 2, 2], dpi=100) # warm up the font cache and imports
+    results = list()
+    for name in cases:
+        make, aggregate, plot, max_size = CASES[name]
+        for size in sizes:
+            if max_size and size > max_size:
+                continue
+            data = make(np.random.default_rng(seed), size)
+            result = {'case': name,
+                      'size': size,
+                      'aggregate_s': _best_time(lambda: aggregate(data), repeat),
+                      'total_s': _best_time(lambda: plot(plotter, data), repeat),
+                      'peak_bytes': _peak_memory(lambda: plot(plotter, data))}
+            results.append(result)
+            print('{case:<24} {size:>11,} aggregate {aggregate_s:9.4f}s  total {total_s:9.4f}s  '
+                  'peak {peak_mb:9.1f} MB'.format(peak_mb=result['peak_bytes'] / 2 ** 20, **result))
+            sys.stdout.flush()
+    return results
+
+
+def metadata():
+    import matplotlib
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit or None,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'machine': platform.machine()}
+
+
+def compare(results, baseline, threshold=1.25):
+    '''
+    Prints how every result changed relative to the baseline results.
+
+    :return: the (case, size, metric) triples that got worse by more than threshold times
+    '''
+    before = {(r['case'], r['size']): r for r in baseline}
+    regressions = list()
+    for result in results:
+        old = before.get((result['case'], result['size']))
+        if not old:
+            continue
+        changes = list()
+        for metric in ('aggregate_s', 'total_s', 'peak_bytes'):
+            ratio = result[metric] / old[metric] if old[metric] else 1.
+            changes.append('{} x{:.2f}'.format(metric, ratio))
+            if ratio > threshold:
+                regressions.append((result['case'], result['size'], metric))
+        print('{:<24} {:>11,}  {}'.format(result['case'], result['size'], '  '.join(changes)))
+    for case, size, metric in regressions:
+        print('REGRESSION: {} at {:,} points: {} is over x{}'.format(case, size, metric, threshold))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--min-exp', type=int, default=3, help='smallest size as a power of 10')
+    parser.add_argument('--max-exp', type=int, default=6, help='largest size as a power of 10 (up to 8)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', help='a JSON file to write the results to')
+    parser.add_argument('--compare', help='a JSON file of earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='the slowdown ratio that counts as a regression')
+    args = parser.parse_args()
+
+    sizes = [10 ** e for e in range(args.min_exp, args.max_exp + 1)]
+    results = run(args.cases, sizes, repeat=args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'meta': metadata(), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,45 @@
-import seaborn as sns
-import matplotlib.pyplot as plt
-from matplotlib import colors as mcolors
+import functools
 import random
 
+import numpy as np
+
+# the table of all colors, loaded once per process and shared by every ColorTheory
+_colors = None
+# the same colors as an (n, 4) RGBA array and an (n, 3) CIELAB array, without duplicates
+_rgba = None
+_lab = None
+
+
+@functools.lru_cache(maxsize=4096)
+def _to_rgba(color):
+    from matplotlib import colors as mcolors
+    return mcolors.to_rgba(color)
+
+
+def to_rgba(color):
+    '''
+    Converts any Matplotlib color (a name, a hex string or an RGB(A) sequence) to an RGBA tuple,
+    remembering the conversions of names and tuples.
+    '''
+    if isinstance(color, (list, np.ndarray)):
+        color = tuple(float(c) for c in color)
+    return _to_rgba(color)
+
+
+def rgb_to_lab(rgb):
+    '''
+    Converts sRGB colors (an (n, 3) or (n, 4) array of values in [0, 1]) to CIELAB (D65),
+    where Euclidean distances approximate perceived differences.
+    '''
+    rgb = np.asarray(rgb, dtype=float)[..., :3]
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ np.array([[0.4124, 0.2126, 0.0193],
+                             [0.3576, 0.7152, 0.1192],
+                             [0.1805, 0.0722, 0.9505]])
+    xyz /= np.array([0.95047, 1., 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
 class ColorTheory:
     '''
     This class is designed to help make a plot's color scheme aesthetically
@@ -14,13 +51,23 @@ class ColorTheory:
         self.diverging_palettes = ['BrBG', 'RdBu_r', 'coolwarm']
         # all palettes
         self.palettes = self.default_palettes + self.basic_palettes + self.diverging_palettes
-        # all colors from palettes
-        self.colors = self.load_colors()
+
+    @property
+    def colors(self):
+        '''
+        All colors from palettes. They are loaded the first time any ColorTheory needs them.
+        '''
+        global _colors
+        if _colors is None:
+            _colors = self.load_colors()
+        return _colors
 
     def load_colors(self):
         '''
         This method loads all the named Matplotlib colors and colors from the seaborn palettes.
         '''
+        import seaborn as sns
+        from matplotlib import colors as mcolors
         colors = list(mcolors.BASE_COLORS.values()) + list(mcolors.CSS4_COLORS.values())
         for palette_name in self.palettes:
             palette = sns.color_palette(palette_name)
@@ -28,6 +75,56 @@ class ColorTheory:
                 colors.append(color)
         return colors
 
+    @property
+    def rgba(self):
+        '''
+        The distinct colors of the table as an (n, 4) RGBA array.
+        '''
+        global _rgba, _lab
+        if _rgba is None:
+            _rgba = np.unique(np.array([to_rgba(color) for color in self.colors]), axis=0)
+            _lab = rgb_to_lab(_rgba)
+        return _rgba
+
+    @property
+    def lab(self):
+        '''
+        The colors of rgba in CIELAB.
+        '''
+        self.rgba
+        return _lab
+
+    def nearest(self, colors):
+        '''
+        :colors: one color or a list of colors
+        :return: the index (or indices) in rgba of the perceptually closest table color
+        '''
+        single = isinstance(colors, str) or not isinstance(colors[0], (str, tuple, list, np.ndarray))
+        lab = rgb_to_lab([to_rgba(color) for color in ([colors] if single else colors)])
+        distances = np.sum((lab[:, None, :] - self.lab[None, :, :]) ** 2, axis=-1)
+        indices = np.argmin(distances, axis=1)
+        return indices[0] if single else indices
+
+    def get_colors(self, n, avoid=('white',)):
+        '''
+        Picks n colors of the table that are as different from each other (and from the colors
+        to avoid, e.g. the background) as possible, by farthest-point sampling in CIELAB.
+        The choice is deterministic; past the size of the table, colors repeat in the same order.
+
+        :return: an (n, 4) RGBA array
+        '''
+        lab = self.lab
+        # the distance from every table color to its closest chosen (or avoided) color
+        closest = np.full(len(lab), np.inf)
+        for color in avoid:
+            closest = np.minimum(closest, np.sum((lab - rgb_to_lab(to_rgba(color))) ** 2, axis=-1))
+        chosen = list()
+        for _ in range(min(n, len(lab))):
+            index = int(np.argmax(closest))
+            chosen.append(index)
+            closest = np.minimum(closest, np.sum((lab - lab[index]) ** 2, axis=-1))
+        return self.rgba[np.resize(chosen, n)] if n else np.empty((0, 4))
+
     def get_color(self):
         '''
         For now, this method just returns a random color. In the future, it
@@ -44,6 +141,8 @@ class ColorTheory:
         Use this method to avoid having to Google "matplotlib named colors" every
         time you plot.
         '''
+        import matplotlib.pyplot as plt
+        from matplotlib import colors as mcolors
         colors = dict(mcolors.BASE_COLORS, **mcolors.CSS4_COLORS)
 
         # Sort colors by hue, saturation, value and name.
@@ -91,6 +190,8 @@ class ColorTheory:
         '''
         Use this method to list a bunch of possible color palettes.
         '''
+        import seaborn as sns
+        import matplotlib.pyplot as plt
         for palette_name in self.palettes:
             palette = sns.color_palette(palette_name)
             sns.palplot(palette)
@@ -0,0 +1,59 @@
+import threading
+
+
+class FigurePool:
+    '''
+    Keeps one preconfigured figure per template key (size, scales, grid, ...) and thread,
+    so that drawing the same shape of chart again only replaces its data instead of
+    building the figure, axes, ticks and fonts from scratch.
+    '''
+    def __init__(self):
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def _templates(self):
+        if not hasattr(self._local, 'templates'):
+            self._local.templates = dict()
+        return self._local.templates
+
+    def get(self, key):
+        '''
+        :return: the cleared Axes of the template for key, or None if there isn't one yet
+        '''
+        ax = self._templates().get(key)
+        if ax is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        clear_data(ax)
+        return ax
+
+    def put(self, key, ax):
+        self._templates()[key] = ax
+
+    def clear(self):
+        '''
+        Drops every template of the calling thread.
+        '''
+        self._templates().clear()
+
+
+def clear_data(ax):
+    '''
+    Removes everything a plot method adds to a template Axes (data artists, the legend,
+    colorbars and explicit ticks) while keeping its title, labels, scales and styling.
+    '''
+    for artist in list(ax.lines) + list(ax.collections) + list(ax.patches) + list(ax.images) + list(ax.texts):
+        artist.remove()
+    if ax.legend_ is not None:
+        ax.legend_.remove()
+    for other in ax.figure.axes:
+        if other is not ax:
+            other.remove()
+    # setting the scales again restores their default tick locators and formatters
+    ax.set_xscale(ax.get_xscale())
+    ax.set_yscale(ax.get_yscale())
+    ax.relim()
+    ax.set_autoscale_on(True)
+    ax.autoscale_view()
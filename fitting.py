@@ -0,0 +1,220 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+import aggregation
+
+
+class PowerLawFit:
+    '''
+    A maximum-likelihood power-law fit p(x) ~ x^-alpha of the tail x >= xmin of some data,
+    with xmin chosen to minimize the Kolmogorov-Smirnov distance (Clauset, Shalizi and Newman, 2009).
+
+    :alpha: the exponent
+    :xmin: where the power-law tail starts
+    :ks: the KS distance between the tail and the fit
+    :n: the number of values fitted
+    :n_tail: the number of values >= xmin
+    :discrete: whether the values are integers (fitted with the usual xmin - 1/2 approximation)
+    :alphas: the alpha of each bootstrap replicate (empty without bootstrapping)
+    :xmins: the xmin of each bootstrap replicate
+    :ci: the confidence level of alpha_ci and xmin_ci
+    '''
+    def __init__(self, alpha, xmin, ks, n, n_tail, discrete, alphas=(), xmins=(), ci=0.95):
+        self.alpha = alpha
+        self.xmin = xmin
+        self.ks = ks
+        self.n = n
+        self.n_tail = n_tail
+        self.discrete = discrete
+        self.alphas = np.asarray(alphas)
+        self.xmins = np.asarray(xmins)
+        self.ci = ci
+
+    @property
+    def alpha_ci(self):
+        return _interval(self.alphas, self.ci)
+
+    @property
+    def xmin_ci(self):
+        return _interval(self.xmins, self.ci)
+
+    def ccdf(self, x, alpha=None):
+        '''
+        :return: the fitted P(X >= x) of the whole data for x >= xmin (optionally with another alpha)
+        '''
+        alpha = self.alpha if alpha is None else alpha
+        shift = 0.5 if self.discrete else 0.
+        x = np.asarray(x, dtype=float)
+        return self.n_tail / self.n * ((x - shift) / (self.xmin - shift)) ** (1 - alpha)
+
+    def as_dict(self):
+        '''
+        :return: the parameters of the fit (without the replicates), as JSON-serializable values
+        '''
+        return {'alpha': float(self.alpha),
+                'xmin': float(self.xmin),
+                'ks': float(self.ks),
+                'n': int(self.n),
+                'n_tail': int(self.n_tail),
+                'discrete': bool(self.discrete),
+                'ci': float(self.ci)}
+
+    def label(self):
+        text = 'alpha = {:.2f}'.format(self.alpha)
+        if len(self.alphas):
+            text += ' [{:.2f}, {:.2f}]'.format(*self.alpha_ci)
+        return text + ', xmin = {:g}'.format(self.xmin)
+
+    def __repr__(self):
+        return 'PowerLawFit(alpha={:.4f}, xmin={:g}, ks={:.4f}, n_tail={}, alpha_ci={})'.format(
+            self.alpha, self.xmin, self.ks, self.n_tail, self.alpha_ci)
+
+
+def _interval(samples, ci):
+    if len(samples) == 0:
+        return None
+    tail = (1 - ci) / 2 * 100
+    return tuple(np.percentile(samples, [tail, 100 - tail]))
+
+
+def _scan(values, counts, discrete, min_tail=10, max_candidates=200, max_ks_points=2000):
+    '''
+    Fits alpha for many xmin candidates at once and picks the one with the smallest KS distance.
+    Every candidate's alpha comes from suffix sums of the counts and logs, and the KS
+    distances are computed a block of candidates at a time by broadcasting over the values.
+
+    :values: the sorted distinct positive values
+    :counts: their counts
+    :return: alpha, xmin, ks and n_tail of the best candidate
+    '''
+    shift = 0.5 if discrete else 0.
+    n = np.sum(counts)
+    # suffix sums: the number of values >= values[i] and the sum of their logs
+    tail_counts = np.cumsum(counts[::-1])[::-1]
+    # Clauset et al.'s discrete approximation, 1 + n / sum(log(x / (xmin - 1/2))), only shifts xmin
+    tail_logs = np.cumsum((counts * np.log(values))[::-1])[::-1]
+    candidates = np.flatnonzero(tail_counts >= min_tail)
+    if len(candidates) == 0:
+        candidates = np.array([0])
+    if len(candidates) > max_candidates:
+        candidates = np.unique(np.linspace(0, candidates[-1], max_candidates).astype(np.intp))
+    n_tail = tail_counts[candidates]
+    log_xmin = np.log(values[candidates] - shift)
+    alphas = 1 + n_tail / (tail_logs[candidates] - n_tail * log_xmin)
+    # the empirical and fitted P(X >= x) are compared at (at most max_ks_points of) the distinct values
+    points = np.unique(np.linspace(0, len(values) - 1, min(len(values), max_ks_points)).astype(np.intp))
+    log_points = np.log(values[points] - shift)
+    ks = np.empty(len(candidates))
+    block = max(1, 2 ** 22 // len(points))
+    for start in range(0, len(candidates), block):
+        c = slice(start, start + block)
+        empirical = tail_counts[points][None, :] / n_tail[c, None]
+        fitted = np.exp((1 - alphas[c, None]) * (log_points[None, :] - log_xmin[c, None]))
+        in_tail = points[None, :] >= candidates[c, None]
+        ks[c] = np.max(np.where(in_tail, np.abs(empirical - fitted), 0.), axis=1)
+    ks[~np.isfinite(alphas)] = np.inf
+    best = np.argmin(ks)
+    return alphas[best], values[candidates[best]], ks[best], n_tail[best]
+
+
+def fit_power_law_counts(values, counts, **scan_kwargs):
+    '''
+    Fits a power law to data given as distinct values and their counts (see fit_power_law).
+
+    :return: alpha, xmin, ks, n_tail and whether the data is discrete
+    '''
+    values = np.asarray(values, dtype=float)
+    counts = np.asarray(counts)
+    positive = values > 0
+    values, counts = values[positive], counts[positive]
+    discrete = bool(np.all(values == np.round(values)))
+    alpha, xmin, ks, n_tail = _scan(values, counts, discrete, **scan_kwargs)
+    return alpha, xmin, ks, n_tail, discrete
+
+
+def fit_power_law(data, counts=None, bootstrap=0, workers=None, seed=0, ci=0.95):
+    '''
+    Fits a power law to the positive values of data by maximum likelihood, scanning xmin.
+
+    :data: the values (anything aggregation.count_values accepts), or the values of a (value, count) table
+    :counts: the number of times each value of data occurs, if data is already aggregated
+    :bootstrap: the number of bootstrap replicates to estimate confidence intervals with;
+                replicates resample the counts (multinomially), so each costs time proportional
+                to the number of distinct values rather than to the size of the data
+    :workers: the number of processes to run the replicates on (defaults to the number of cores)
+    :seed: the seed of the replicates, which give the same results for any number of workers
+    :ci: the confidence level of the intervals
+    :return: a PowerLawFit
+    '''
+    if counts is None:
+        values, counts = aggregation.count_values(data)
+    else:
+        values, counts = aggregation.value_counts(data, counts)
+    values = np.asarray(values, dtype=float)
+    alpha, xmin, ks, n_tail, discrete = fit_power_law_counts(values, counts)
+    replicates = run_bootstrap(_power_law_replicate, (values, counts), bootstrap, workers, seed)
+    return PowerLawFit(alpha, xmin, ks, int(np.sum(counts[values > 0])), int(n_tail), discrete,
+                       alphas=[r[0] for r in replicates], xmins=[r[1] for r in replicates], ci=ci)
+
+
+def _power_law_replicate(data, rng):
+    values, counts = data
+    n = np.sum(counts)
+    resampled = rng.multinomial(n, counts / n)
+    present = resampled > 0
+    alpha, xmin, _, _, _ = fit_power_law_counts(values[present], resampled[present])
+    return alpha, xmin
+
+
+def bootstrap_linear_fit(x, y, bootstrap=1000, workers=None, seed=0):
+    '''
+    Fits y = slope * x + intercept to resampled (x, y) pairs.
+
+    :return: the slopes and the intercepts of the replicates
+    '''
+    replicates = run_bootstrap(_linear_replicate, (np.asarray(x, dtype=float), np.asarray(y, dtype=float)),
+                               bootstrap, workers, seed)
+    replicates = np.asarray(replicates).reshape(-1, 2)
+    return replicates[:, 0], replicates[:, 1]
+
+
+def _linear_replicate(data, rng):
+    x, y = data
+    sample = rng.integers(0, len(x), len(x))
+    return tuple(np.polyfit(x[sample], y[sample], deg=1))
+
+
+_worker_data = None
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _run_replicates(function, seeds):
+    return [function(_worker_data, np.random.default_rng(seed)) for seed in seeds]
+
+
+def run_bootstrap(function, data, replicates, workers=None, seed=0):
+    '''
+    Runs function(data, rng) once per replicate, each with its own random generator spawned
+    from seed, across a pool of processes (data is sent to each process once).
+
+    :return: the results of the replicates, in order
+    '''
+    if not replicates:
+        return list()
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    workers = min(workers if workers else os.cpu_count(), replicates)
+    if workers <= 1:
+        return [function(data, np.random.default_rng(s)) for s in seeds]
+    batches = [seeds[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+        results = list(pool.map(_run_replicates, [function] * workers, batches))
+    # undo the round-robin split into batches
+    ordered = [None] * replicates
+    for i, batch in enumerate(results):
+        ordered[i::workers] = batch
+    return ordered
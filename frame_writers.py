@@ -0,0 +1,103 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+
+class GifWriter:
+    '''
+    Writes an animated GIF (with Pillow) frame by frame: each frame is reduced to its own
+    256-color palette and appended to the file as soon as it is drawn, so memory doesn't grow
+    with the number of frames.
+    '''
+    def __init__(self, path, fps):
+        self.path = path
+        self.duration = int(round(1000 / fps))
+        self.file = None
+
+    def write(self, rgba):
+        from PIL import Image, GifImagePlugin
+        frame = Image.fromarray(np.ascontiguousarray(rgba[..., :3])).quantize(256)
+        if self.file is None:
+            self.file = open(self.path, 'wb')
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0, 'duration': self.duration})
+            self.file.write(b''.join(header))
+        for data in GifImagePlugin.getdata(frame, duration=self.duration, include_color_table=True):
+            self.file.write(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(b';') # the GIF trailer
+            self.file.close()
+        self.file = None
+
+
+class PngSequenceWriter:
+    '''
+    Writes every frame as its own PNG as soon as it is drawn.
+
+    :pattern: a path with a %d-style field for the frame number, e.g. 'frames/frame_%05d.png'
+    '''
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.count = 0
+        directory = os.path.dirname(pattern)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, rgba):
+        from PIL import Image
+        Image.fromarray(rgba).save(self.pattern % self.count)
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+class FFmpegWriter:
+    '''
+    Pipes raw RGBA frames into an ffmpeg process, which encodes them as they arrive.
+    '''
+    def __init__(self, path, fps, size, executable='ffmpeg'):
+        width, height = size
+        command = [executable, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+                   # most codecs need even dimensions
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, rgba):
+        self.process.stdin.write(np.ascontiguousarray(rgba).tobytes())
+
+    def close(self):
+        _, errors = self.process.communicate()
+        if self.process.returncode:
+            raise RuntimeError('ffmpeg failed: {}'.format(errors.decode(errors='replace').strip()))
+
+
+def ffmpeg_path():
+    '''
+    :return: the path of the ffmpeg executable Matplotlib is configured with, or None if it isn't installed
+    '''
+    import matplotlib
+    return shutil.which(matplotlib.rcParams['animation.ffmpeg_path'])
+
+
+def open_writer(path, fps, size):
+    '''
+    Picks a frame writer from path: a GIF for .gif, a PNG sequence for a pattern with a
+    %d-style field or a directory, and a video through ffmpeg for anything else (e.g. .mp4).
+
+    :size: the (width, height) of the frames in pixels
+    '''
+    if path.lower().endswith('.gif'):
+        return GifWriter(path, fps)
+    if '%' in path:
+        return PngSequenceWriter(path)
+    if path.endswith(os.sep) or os.path.isdir(path) or not os.path.splitext(path)[1]:
+        return PngSequenceWriter(os.path.join(path, 'frame_%05d.png'))
+    executable = ffmpeg_path()
+    if executable is None:
+        raise ValueError('Writing {} requires ffmpeg; save as a .gif or a PNG sequence instead.'.format(path))
+    return FFmpegWriter(path, fps, size, executable)
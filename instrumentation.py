@@ -0,0 +1,77 @@
+import time
+
+
+class PlotRecord:
+    '''
+    What one call to a plot method did, as passed to a Plotter's listeners.
+
+    :method: the name of the plot method
+    :phases: the wall time in seconds spent in each phase: 'setup' (figure and axes), 'aggregate'
+             (counting, sorting, binning or fitting the data), 'draw' (creating artists),
+             'layout' (the tight bounding box) and 'encode' (writing images)
+    :points: the number of data points drawn
+    :artists: the number of artists drawn
+    :bytes: the size of the images written to files or memory (saves done in the background aren't counted)
+    :cache_hit: True or False if the call went through a render cache, otherwise None
+    :total: the wall time of the whole call
+    '''
+    def __init__(self, method):
+        self.method = method
+        self.phases = dict()
+        self.points = 0
+        self.artists = 0
+        self.bytes = 0
+        self.cache_hit = None
+        self.total = 0.
+        self.figure = None
+        self._start = self._last = time.perf_counter()
+
+    def lap(self, phase):
+        '''
+        Adds the time since the previous lap to phase.
+        '''
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.) + now - self._last
+        self._last = now
+
+    def finish(self):
+        self.total = time.perf_counter() - self._start
+        if self.figure is not None:
+            self.points, self.artists = count_drawn(self.figure)
+            self.figure = None
+
+    def as_dict(self):
+        return {'method': self.method,
+                'phases': dict(self.phases),
+                'points': self.points,
+                'artists': self.artists,
+                'bytes': self.bytes,
+                'cache_hit': self.cache_hit,
+                'total': self.total}
+
+    def __repr__(self):
+        return 'PlotRecord({})'.format(self.as_dict())
+
+
+def artist_points(artist):
+    '''
+    :return: the number of data points an artist draws (1 for a patch or an image)
+    '''
+    if hasattr(artist, 'get_xdata'):
+        return len(artist.get_xdata())
+    if hasattr(artist, 'get_offsets'):
+        return max(len(artist.get_offsets()), len(artist.get_paths()))
+    return 1
+
+
+def count_drawn(fig):
+    '''
+    :return: the number of data points and the number of artists on the axes of fig
+    '''
+    points = 0
+    artists = 0
+    for ax in fig.axes:
+        drawn = list(ax.lines) + list(ax.collections) + list(ax.patches) + list(ax.images)
+        points += sum(artist_points(artist) for artist in drawn)
+        artists += len(drawn) + len(ax.texts)
+    return points, artists
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+
+class PlotData:
+    '''
+    The compact result of Plotter.compute: the arrays a plot is drawn from (counts, bin edges,
+    fitted parameters, ...) and its metadata, which Plotter.render draws without looking at
+    the raw data again. It can be saved as a .npz file, or as JSON when it is small.
+
+    :method: the name of the plot method it is drawn with
+    :arrays: a dict of name -> NumPy array
+    :meta: a dict of JSON-serializable values
+    '''
+    def __init__(self, method, arrays, meta=None):
+        self.method = method
+        self.arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        self.meta = meta or dict()
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def save(self, path):
+        '''
+        Saves to path, as JSON if it ends in .json and as a compressed .npz file otherwise.
+        '''
+        header = {'method': self.method, 'meta': self.meta}
+        if path.lower().endswith('.json'):
+            header['arrays'] = {name: {'dtype': array.dtype.str, 'shape': array.shape, 'data': array.ravel().tolist()}
+                                for name, array in self.arrays.items()}
+            with open(path, 'w') as f:
+                json.dump(header, f)
+        else:
+            with open(path, 'wb') as f:
+                np.savez_compressed(f, __plot_data__=np.array(json.dumps(header)), **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        if path.lower().endswith('.json'):
+            with open(path) as f:
+                header = json.load(f)
+            arrays = {name: np.array(array['data'], dtype=array['dtype']).reshape(array['shape'])
+                      for name, array in header['arrays'].items()}
+        else:
+            with np.load(path, allow_pickle=False) as archive:
+                header = json.loads(str(archive['__plot_data__']))
+                arrays = {name: archive[name] for name in archive.files if name != '__plot_data__'}
+        return cls(header['method'], arrays, header['meta'])
+
+    def __repr__(self):
+        arrays = ', '.join('{}{}'.format(name, array.shape) for name, array in self.arrays.items())
+        return 'PlotData({}, arrays=[{}], meta={})'.format(self.method, arrays, self.meta)
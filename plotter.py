@@ -1,24 +1,419 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
 from color_theory import ColorTheory
 import numpy as np
 from theme import Theme
 import utils
-from collections import defaultdict
+import aggregation
+import fitting
+import io
+from figure_pool import FigurePool
+import render_cache
+import frame_writers
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import time
+import traceback
+import weakref
+import functools
+import inspect
+import threading
+import contextlib
+from instrumentation import PlotRecord, artist_points
+from shards import Shards
+from plot_data import PlotData
+import tiles
+
+
+def _pyplot():
+    '''
+    Imports pyplot on first use. pyplot (like seaborn) is slow to import, so it is only
+    loaded once something is actually shown or drawn through it.
+    '''
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _plot_method(method):
+    '''
+    Wraps every public plot method. If the Plotter has listeners, the call is timed phase by
+    phase and its PlotRecord is passed to them; if it has a render cache, the call may be
+    answered from it.
+    '''
+    signature = inspect.signature(method)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._listeners:
+            return _cached_call(self, method, signature, args, kwargs)
+        record = PlotRecord(method.__name__)
+        outer = getattr(self._local, 'record', None)
+        self._local.record = record
+        try:
+            result = _cached_call(self, method, signature, args, kwargs, record)
+        finally:
+            self._local.record = outer
+        record.finish()
+        for listener in list(self._listeners):
+            listener(record)
+        return result
+    return wrapper
+
+
+def _cached_call(plotter, method, signature, args, kwargs, record=None):
+    '''
+    Calls a plot method through the Plotter's render cache, if it has one.
+    Only calls that render to an in-memory output and don't save files are cached.
+    '''
+    if plotter.render_cache is None or not plotter.output:
+        return method(plotter, *args, **kwargs)
+    arguments = signature.bind(plotter, *args, **kwargs)
+    arguments.apply_defaults()
+    arguments = dict(arguments.arguments)
+    del arguments['self']
+    if arguments.get('save_path'):
+        return method(plotter, *args, **kwargs)
+    import matplotlib
+    # arguments that name files on disk are keyed by what the files hold
+    for name, fingerprint in _CACHE_FINGERPRINTS.get(method.__name__, {}).items():
+        arguments[name] = fingerprint(arguments[name])
+    key = render_cache.hash_key(method.__name__, arguments, vars(plotter.theme), plotter.fontsize,
+                                plotter.output, plotter.rasterize, matplotlib.__version__)
+    if key is None: # e.g. the data is a generator
+        return method(plotter, *args, **kwargs)
+    image = plotter.render_cache.get(key)
+    if record is not None:
+        record.cache_hit = image is not None
+    if image is not None:
+        return io.BytesIO(image)
+    result = method(plotter, *args, **kwargs)
+    plotter.render_cache.put(key, result.getvalue())
+    return result
+
+
 
 class Plotter:
-    def __init__(self, fontsize=30, theme=None, backend=None):
+    def __init__(self,
+                 fontsize=30,
+                 theme=None,
+                 backend=None,
+                 pyplot=True,
+                 background_save=False,
+                 reuse_figures=False,
+                 output=None,
+                 render_cache=None,
+                 rasterize_points=100000,
+                 rasterize_artists=1000,
+                 raster_dpi=300):
+        '''
+        :fontsize: the font size for titles, labels and ticks
+        :theme: the Theme to color plots with
+        :backend: a matplotlib backend to switch pyplot to
+        :pyplot: if False, every plot is drawn on its own Figure with an Agg canvas instead of
+                 through pyplot, so nothing is shown or registered globally and plotters can be
+                 used from several threads at once; plot methods then return their Figure
+        :background_save: if True, files are written by a background thread so that encoding and
+                          disk I/O overlap with building the next plot (requires pyplot=False);
+                          call flush() to wait for them
+        :reuse_figures: if True, plots of the same shape (size, scales, grid, background) reuse one
+                        preconfigured figure, clearing only its data, instead of building a new one
+                        (requires pyplot=False); a returned Figure is then only valid until the next
+                        plot of the same shape from the same thread
+        :output: 'png', 'svg' or 'pdf' to have plot methods return the encoded image in a BytesIO
+                 (rendered in memory, without showing it or touching the filesystem) instead of
+                 the Figure (requires pyplot=False)
+        :render_cache: a render_cache.RenderCache; plots rendered to an output are then looked up
+                       by a hash of their data, arguments, theme, fontsize, rasterization settings and
+                       matplotlib version, and identical requests return the stored image without
+                       drawing anything
+        :rasterize_points: when saving a vector format (pdf, svg, eps or ps), data layers with more points
+                           than this are rasterized at raster_dpi while axes, labels and legends stay
+                           vectors, so huge scatters don't become huge files (None to never rasterize)
+        :rasterize_artists: likewise, all data layers are rasterized if there are more of them than this
+        :raster_dpi: the resolution of rasterized data layers; eps and ps store them uncompressed,
+                     so they may need a lower one than pdf and svg to come out smaller than vectors
+        '''
+        if background_save and pyplot:
+            raise ValueError('background_save requires pyplot=False.')
+        if reuse_figures and pyplot:
+            raise ValueError('reuse_figures requires pyplot=False.')
+        if output and pyplot:
+            raise ValueError('output requires pyplot=False.')
+        if output not in {None, 'png', 'svg', 'pdf'}:
+            raise ValueError('output should be None, \'png\', \'svg\' or \'pdf\'.')
         self.fontsize = fontsize
-        if not theme:
-            self.theme = Theme() # default theme
-        self.color_genie = ColorTheory()
+        self.pyplot = pyplot
+        self.output = output
+        self.render_cache = render_cache
+        self._listeners = list()
+        self.rasterize = (rasterize_points, rasterize_artists, raster_dpi)
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1) if background_save else None
+        self._pending = list()
+        self._saving = weakref.WeakKeyDictionary() # figure -> its latest background save
+        self.figure_pool = FigurePool() if reuse_figures else None
+        self.theme = theme if theme else Theme() # default theme
+        self._color_genie = None
         if backend:
-            plt.switch_backend(backend)
+            _pyplot().switch_backend(backend)
         return
 
+    @property
+    def color_genie(self):
+        if self._color_genie is None:
+            self._color_genie = ColorTheory()
+        return self._color_genie
+
     def set_theme(self, theme):
         self.theme = theme
 
+    def add_listener(self, listener):
+        '''
+        Registers a callback that is called with an instrumentation.PlotRecord after every plot,
+        e.g. to export per-phase timings, point and artist counts and output sizes to metrics.
+        Plots aren't timed at all while there are no listeners.
+        '''
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    @contextlib.contextmanager
+    def profile(self):
+        '''
+        Collects the PlotRecord of every plot made inside the with block:
+
+            with plotter.profile() as records:
+                plotter.pdf(data, save_path='pdf.png')
+            print(records[0].phases)
+        '''
+        records = list()
+        self.add_listener(records.append)
+        try:
+            yield records
+        finally:
+            self.remove_listener(records.append)
+
+    def _lap(self, phase):
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record.lap(phase)
+
+    @contextlib.contextmanager
+    def _phase(self, phase):
+        '''
+        Times the with block as phase (and whatever came before it since the last lap as drawing).
+        '''
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            yield
+            return
+        record.lap('draw')
+        yield
+        record.lap(phase)
+
+    def render_batch(self, jobs, workers=None):
+        '''
+        Renders many plots in parallel across a pool of headless (Agg) worker processes.
+        Each worker gets its own Plotter with this Plotter's fontsize and theme.
+
+        :jobs: a list of plot specs, each either a dict with the keys 'method', 'data' (a tuple of
+               positional arguments), 'kwargs' and 'save_path', or a (method, data, kwargs, save_path) tuple
+        :workers: the number of processes to use (defaults to the number of cores)
+        :return: a list with one dict per job, in order, with its 'method', 'save_path',
+                 'time' (seconds) and 'error' (a traceback string, or None if it succeeded)
+        '''
+        jobs = [_job_spec(job) for job in jobs]
+        workers = workers if workers else os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.fontsize, self.theme)) as pool:
+            return list(pool.map(_render_job, jobs))
+
+    def compute(self, method, *args, **kwargs):
+        '''
+        Runs only the data aggregation of a plot method (counting, binning, sorting or fitting),
+        so that it can be saved and drawn later, elsewhere or in other styles with render.
+
+        :method: 'pdf', 'pareto', 'rank', 'zipf', 'histogram', 'multi_histogram',
+                 'density_scatter' or 'x_vs_y_with_line'
+        :args: the data, as passed to the method
+        :kwargs: the method's arguments that change the result, e.g. counts, bins or fit
+        :return: a PlotData
+        '''
+        if method not in _STAGES:
+            raise ValueError('{} has no compute stage; it should be one of {}.'.format(method, ', '.join(_STAGES)))
+        return _STAGES[method][0](self, method, *args, **kwargs)
+
+    def render(self, plot_data, **kwargs):
+        '''
+        Draws a PlotData from compute (or the path of a saved one) with the method it was computed for.
+
+        :kwargs: the method's styling arguments, e.g. title, color, save_path or dpi
+        '''
+        if isinstance(plot_data, str):
+            plot_data = PlotData.load(plot_data)
+        return _STAGES[plot_data.method][1](self, plot_data, kwargs)
+
+    @_plot_method
+    def grid(self,
+             kind,
+             series,
+             ncols=None,
+             titles=None,
+             title=None,
+             sharex=True,
+             sharey=True,
+             panel_size=(6, 4.5),
+             fontsize=None,
+             save_path=None,
+             dpi=500,
+             workers=None,
+             **kwargs):
+        '''
+        Draws many series as small multiples: one panel per series, in a single figure that is
+        laid out and encoded once.
+
+        :kind: the name of the plot method to draw every panel with, e.g. 'pdf' or 'histogram'
+        :series: a list of series, or a dict of title -> series; a tuple is passed as several
+                 positional arguments (e.g. (x, y) for x_vs_y)
+        :ncols: the number of columns (defaults to a square grid)
+        :titles: the title of every panel (defaults to the keys of a dict of series)
+        :title: the title of the whole figure
+        :sharex: whether the panels share the x axis (and its ticks)
+        :sharey: whether the panels share the y axis
+        :panel_size: the (width, height) of every panel in inches
+        :fontsize: the font size of the panels (defaults to half of the Plotter's)
+        :workers: the number of threads that count the series of pdf, pareto, rank and zipf panels
+        :kwargs: passed on to every call of the plot method; counts (for pdf, pareto, rank and zipf)
+                 makes every series a table of values and their counts
+        '''
+        if kind in {'grid', 'animate'} or not hasattr(getattr(Plotter, kind, None), '__wrapped__'):
+            raise ValueError('{} is not a plot method.'.format(kind))
+        if isinstance(series, dict):
+            titles = list(series) if titles is None else titles
+            series = list(series.values())
+        series = [item if isinstance(item, tuple) else (item,) for item in series]
+        if not series:
+            raise ValueError('grid needs at least one series to draw.')
+        ncols = ncols or int(np.ceil(np.sqrt(len(series))))
+        nrows = max(1, int(np.ceil(len(series) / ncols)))
+        fontsize = fontsize or self.fontsize // 2
+
+        aggregate = _PANEL_AGGREGATES.get(kind)
+        if aggregate:
+            # the panels are drawn from counts, which merge any counts given for the series
+            counts = kwargs.pop('counts', None)
+            with self._phase('aggregate'), ThreadPoolExecutor(workers) as pool:
+                prepared = list(pool.map(functools.partial(aggregate, counts=counts), series))
+        else:
+            prepared = [(args, dict()) for args in series]
+
+        fig = self.figure((panel_size[0] * ncols, panel_size[1] * nrows))
+        axes = fig.subplots(nrows, ncols, sharex=sharex, sharey=sharey, squeeze=False).ravel()
+        method = getattr(Plotter, kind).__wrapped__
+        for i, (ax, (args, extra)) in enumerate(zip(axes, prepared)):
+            self._local.panel = (ax, fontsize)
+            try:
+                method(self, *args, title=titles[i] if titles else '', **extra, **kwargs)
+            finally:
+                self._local.panel = None
+        for ax in axes[len(prepared):]:
+            ax.remove()
+        # shared axes are only labelled along the bottom row and the left column
+        for i, ax in enumerate(axes[:len(prepared)]):
+            bottom = i + ncols >= len(prepared)
+            if sharex:
+                ax.tick_params(labelbottom=bottom)
+                if not bottom:
+                    ax.set_xlabel('')
+            if sharey and i % ncols:
+                ax.set_ylabel('')
+        if title:
+            fig.suptitle(title, fontsize=self.fontsize)
+        return self._finish(fig, save_path, dpi)
+
+    @_plot_method
+    def animate(self,
+                kind,
+                snapshots,
+                save_path,
+                labels=None,
+                fps=10,
+                dpi=100,
+                title=None,
+                xlabel=None,
+                ylabel=None,
+                xscale=None,
+                yscale=None,
+                xlim=None,
+                ylim=None,
+                color=None,
+                alpha=0.8,
+                marker='o',
+                decimate='log',
+                max_points=2000,
+                size=(15, 10)):
+        '''
+        Animates how a distribution changes over snapshots of data. The axes are drawn once and
+        every frame only redraws the points (blitting), so a frame costs about as much as its data.
+
+        :kind: 'pdf', 'pareto', 'rank' or 'zipf'
+        :snapshots: a list or an iterable of data, one per frame
+        :save_path: a .gif, a PNG sequence (a directory or a pattern like 'frames/%05d.png'),
+                    or a video such as .mp4 if ffmpeg is installed (see frame_writers.open_writer)
+        :labels: a label to show in the corner of every frame, e.g. its time
+        :xlim: the x limits of every frame; unless both xlim and ylim are given, every snapshot
+               is aggregated before the first frame is drawn to find them
+        :decimate: how rank and zipf frames keep a subset of the ranks (see rank_points)
+        :return: the number of frames written
+        '''
+        if kind not in _ANIMATIONS:
+            raise ValueError('kind should be one of {}.'.format(', '.join(_ANIMATIONS)))
+        points, *defaults = _ANIMATIONS[kind]
+        title, xlabel, ylabel, xscale, yscale = (given if given is not None else default for given, default in
+                                                 zip((title, xlabel, ylabel, xscale, yscale), defaults))
+        log = xscale in {'log', 'symlog'}
+        frames = (points(snapshot, decimate, max_points, log) for snapshot in snapshots)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, size=size, reusable=False)
+        if not (xlim and ylim):
+            with self._phase('aggregate'):
+                frames = list(frames)
+                for x, y in frames:
+                    finite = np.isfinite(x) & np.isfinite(y)
+                    ax.update_datalim(np.column_stack([x[finite], y[finite]]))
+            ax.autoscale_view()
+        ax.set_xlim(xlim or ax.get_xlim())
+        ax.set_ylim(ylim or ax.get_ylim())
+        line, = ax.plot([], [], marker, color=self.color(color), alpha=alpha, animated=True)
+        text = ax.text(0.98, 0.96, '', transform=ax.transAxes, ha='right', va='top', fontsize=self.fontsize, animated=True)
+
+        fig = ax.figure
+        fig.set_dpi(dpi)
+        fig.tight_layout()
+        if not hasattr(fig.canvas, 'copy_from_bbox'):
+            # blitting needs an Agg canvas, which pyplot's backend may not be
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            FigureCanvasAgg(fig)
+        canvas = fig.canvas
+        canvas.draw()
+        background = canvas.copy_from_bbox(ax.bbox)
+        self._lap('draw')
+        writer = frame_writers.open_writer(save_path, fps, canvas.get_width_height())
+        count = 0
+        try:
+            for count, (x, y) in enumerate(frames, 1):
+                canvas.restore_region(background)
+                line.set_data(x, y)
+                ax.draw_artist(line)
+                if labels is not None:
+                    text.set_text(str(labels[count - 1]))
+                    ax.draw_artist(text)
+                writer.write(np.asarray(canvas.buffer_rgba()))
+        finally:
+            writer.close()
+            if self.pyplot:
+                _pyplot().close(fig)
+        self._lap('encode')
+        return count
+
     def plot(self,
              title,
              xlabel='X-axis',
@@ -30,7 +425,8 @@ class Plotter:
              ylim=None,
              grid=True,
              top_line=True,
-             background=(0.8588235294117647, 0.8588235294117647, 0.8588235294117647)):
+             background=(0.8588235294117647, 0.8588235294117647, 0.8588235294117647),
+             reusable=True):
         '''
         The main plot function. This is responsible for managing the plot.
         Every type of plot should call this function.
@@ -38,38 +434,176 @@ class Plotter:
         :title: The title for the plot
         :xlabel: The xlabel for the plot
         :ylabel: The ylabel for the plot
+        :reusable: whether the figure may come from (and go back to) the figure pool
+        :return: the Axes to draw on
         '''
-        fig = plt.figure(figsize=size) 
+        panel = getattr(self._local, 'panel', None)
+        if panel is not None:
+            # drawing one panel of a grid (see grid)
+            ax, fontsize = panel
+            # setting the scale of a shared axis sets it on every panel sharing it
+            if xscale and ax.get_xscale() != xscale:
+                ax.set_xscale(xscale)
+            if yscale and ax.get_yscale() != yscale:
+                ax.set_yscale(yscale)
+            # minor ticks are too small to read on a panel, and each one is an artist to lay out
+            ax.minorticks_off()
+            ax.tick_params(labelsize=fontsize)
+            if background != 'white':
+                ax.set_facecolor(background)
+            if grid:
+                ax.grid(True)
+            if not top_line:
+                ax.spines['top'].set_visible(False)
+            if xlim:
+                ax.set_xlim(xlim)
+            if ylim:
+                ax.set_ylim(ylim)
+            ax.set_title(title, fontsize=fontsize)
+            ax.set_xlabel(xlabel, fontsize=fontsize)
+            ax.set_ylabel(ylabel, fontsize=fontsize)
+            self._lap('setup')
+            return ax
+        ax = None
+        if self.figure_pool is not None and reusable:
+            key = (tuple(size), xscale, yscale, grid, top_line, background, self.fontsize)
+            ax = self.figure_pool.get(key)
+            if ax is not None:
+                # the figure may still be being written by the background writer
+                saving = self._saving.get(ax.figure)
+                if saving:
+                    saving.exception()
+                ax.tick_params(labelsize=self.fontsize, labelrotation=0)
+        if ax is None:
+            fig = self.figure(size)
+            ax = fig.add_subplot(1, 1, 1)
+            if xscale:
+                ax.set_xscale(xscale)
+            if yscale:
+                ax.set_yscale(yscale)
+
+            ax.tick_params(labelsize=self.fontsize)
+            if background != 'white':
+                ax.set_facecolor(background)
+            if grid:
+                ax.grid()
+            if not top_line:
+                ax.spines['top'].set_visible(False)
+            if self.figure_pool is not None and reusable:
+                self.figure_pool.put(key, ax)
         if xlim:
-            plt.xlim(xlim)
+            ax.set_xlim(xlim)
         if ylim:
-            plt.ylim(ylim)
-        plt.title(title, fontsize=self.fontsize)
-        plt.xlabel(xlabel, fontsize=self.fontsize)
-        plt.ylabel(ylabel, fontsize=self.fontsize)
-        if xscale:
-            plt.xscale(xscale)
-        if yscale:
-            plt.yscale(yscale)
-
-        plt.xticks(fontsize=self.fontsize)
-        plt.yticks(fontsize=self.fontsize)
-        if background != 'white':
-            plt.rcParams['axes.facecolor'] = background
-        if grid:
-            plt.grid()
-        if not top_line:
-            ax = plt.gca()
-            ax.spines['top'].set_visible(False)
-
-    def save(self, path, dpi=500, sns_plot=None, transparent=False):
-        if not path.endswith('.jpg') and not path.endswith('.png') and not path.endswith('.pdf'):
-            print('Path to save should end in .jpg or .png or .pdf')
+            ax.set_ylim(ylim)
+        ax.set_title(title, fontsize=self.fontsize)
+        ax.set_xlabel(xlabel, fontsize=self.fontsize)
+        ax.set_ylabel(ylabel, fontsize=self.fontsize)
+        self._lap('setup')
+        return ax
+
+    def figure(self, size=(15,10)):
+        '''
+        Creates a new figure, through pyplot or (if this Plotter doesn't use pyplot)
+        as a standalone Figure with its own Agg canvas.
+        '''
+        if self.pyplot:
+            return _pyplot().figure(figsize=size)
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=size)
+        FigureCanvasAgg(fig)
+        return fig
+
+    def save(self, path, dpi=500, sns_plot=None, transparent=False, fig=None):
+        '''
+        Saves a plot to one or more files.
+
+        :path: a path ending in .jpg, .png, .pdf, .svg, .eps or .ps, or a list of paths and/or (path, dpi) pairs,
+               e.g. ['chart.pdf', ('chart.png', 500), ('thumbnail.png', 50)], which are all
+               written from the same drawing
+        :dpi: the resolution of every path that doesn't give its own
+        :fig: the figure to save (defaults to the current pyplot figure)
+        :return: if this Plotter saves in the background, a Future that is done once every file is written
+        '''
+        targets = list()
+        for target in ([path] if isinstance(path, str) else path):
+            target, target_dpi = (target, dpi) if isinstance(target, str) else target
+            if target.split('.')[-1] not in _SAVE_FORMATS:
+                print('Path to save should end in .jpg, .png, .pdf, .svg, .eps or .ps')
+                continue
+            targets.append((target, target_dpi))
+        if not targets:
             return
         if sns_plot:
-            sns_plot.savefig(path, format='jpg', dpi=dpi, bbox_inches='tight')
-        else:
-            plt.savefig(path, format=path.split('.')[-1], bbox_inches='tight', transparent=transparent)
+            for target, target_dpi in targets:
+                sns_plot.savefig(target, format='jpg', dpi=target_dpi, bbox_inches='tight')
+            return
+        fig = fig if fig else _pyplot().gcf()
+        if self._writer:
+            # forget saves that finished fine, and wait if too many are queued up
+            self._pending = [future for future in self._pending if not future.done() or future.exception()]
+            if len(self._pending) >= _MAX_PENDING_SAVES:
+                self._pending[0].exception()
+            future = self._writer.submit(_write_figure, fig, targets, transparent, None, self.rasterize)
+            self._pending.append(future)
+            self._saving[fig] = future
+            return future
+        _write_figure(fig, targets, transparent, getattr(self._local, 'record', None), self.rasterize)
+
+    def flush(self):
+        '''
+        Waits until every background save has been written, re-raising the first error if any failed.
+        '''
+        pending, self._pending = self._pending, list()
+        for future in pending:
+            future.result()
+
+    def to_bytes(self, fig, format='png', dpi=500, transparent=False):
+        '''
+        Renders a figure in memory.
+
+        :format: 'png', 'svg' or 'pdf'
+        :return: a BytesIO holding the encoded image (use getvalue() for bytes or getbuffer() for a memoryview)
+        '''
+        # a figure can't be drawn by the background writer and here at once
+        saving = self._saving.get(fig)
+        if saving:
+            saving.exception()
+        record = getattr(self._local, 'record', None)
+        bbox_inches = _tight_bbox(fig, dpi)
+        if record is not None:
+            record.lap('layout')
+        buffer = io.BytesIO()
+        with _rasterize_dense(fig, *self.rasterize[:2], vector=format in _VECTOR_FORMATS) as rasterized:
+            fig.savefig(buffer, format=format, dpi=self.rasterize[2] if rasterized else dpi,
+                        bbox_inches=bbox_inches, transparent=transparent)
+        buffer.seek(0)
+        if record is not None:
+            record.lap('encode')
+            record.bytes += len(buffer.getbuffer())
+        return buffer
+
+    def _finish(self, fig, save_path=None, dpi=500, transparent=False):
+        '''
+        Saves (if a save_path is given) and shows a finished plot.
+        Plotters that don't use pyplot return the Figure instead of showing it,
+        or the encoded image if they have an output format.
+        '''
+        if getattr(self._local, 'panel', None) is not None:
+            # the grid finishes the whole figure once every panel is drawn
+            return None
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record.lap('draw')
+            record.figure = fig
+        if save_path:
+            self.save(save_path, dpi, transparent=transparent, fig=fig)
+        if self.pyplot:
+            _pyplot().show()
+            return None
+        if self.output:
+            return self.to_bytes(fig, self.output, dpi, transparent)
+        return fig
 
     def color(self, given_color):
         if given_color:
@@ -85,6 +619,57 @@ class Plotter:
         else:
             return self.theme.primary
 
+    def _counted(self, data, counts=None):
+        '''
+        :return: the sorted distinct values of data and their counts, counting data unless counts are given
+        '''
+        if isinstance(data, Shards):
+            return data.count_values()
+        if counts is None:
+            return aggregation.count_values(data)
+        return aggregation.value_counts(data, counts)
+
+    def series_colors(self, colors, ax):
+        '''
+        Fills in the missing (None) colors of a list of series colors with colors that are as
+        distinct as possible from each other, the given colors and the background of ax.
+        '''
+        colors = [self.color(color) if color else None for color in colors]
+        missing = [i for i, color in enumerate(colors) if color is None]
+        if missing:
+            avoid = [ax.get_facecolor()] + [color for color in colors if color is not None]
+            for i, color in zip(missing, self.color_genie.get_colors(len(missing), avoid=avoid)):
+                colors[i] = color
+        return colors
+
+    def rank_points(self, values, decimate=None, max_points=None, xscale=None, counts=None):
+        '''
+        Sorts values from largest to smallest, optionally keeping only a subset of the ranks.
+
+        :decimate: None to keep every rank, 'log' for log-spaced ranks or 'pixel' for
+                   about one rank per pixel of the (default 15 inch wide) figure
+        :max_points: the number of ranks to keep when decimating
+        :counts: the number of times each value occurs, if values is a (value, count) table;
+                 tables are ranked exactly like the values they count unless decimate is given
+
+        values can also be a Shards; as shards usually hold more values than fit in memory, they
+        are decimated by pixel (with a notice) when they hold more than a million values and
+        decimate isn't given.
+        '''
+        if isinstance(values, Shards):
+            with self._phase('aggregate'):
+                values, counts = values.count_values()
+            if not decimate and np.sum(counts) > _MAX_EXACT_RANKS:
+                print('Ranking {} values from shards by pixel; pass decimate to choose.'.format(int(np.sum(counts))))
+                decimate = 'pixel'
+        if not max_points:
+            import matplotlib
+            max_points = int(15 * matplotlib.rcParams['figure.dpi']) if decimate == 'pixel' else 2000
+        with self._phase('aggregate'):
+            return aggregation.rank_points(values, decimate=decimate, max_points=max_points,
+                                           log=xscale in {'log', 'symlog'}, counts=counts)
+
+    @_plot_method
     def rank(self,
              values,
              title='Rank Plot',
@@ -95,18 +680,24 @@ class Plotter:
              color=None,
              alpha=1.,
              xscale='log',
-             yscale='log'):
+             yscale='log',
+             decimate=None,
+             max_points=None,
+             counts=None):
         '''
         Plots a set of values by rank, from largest to smallest.
 
         :values: the values to plot
+        :decimate: None to plot every value, or 'log'/'pixel' to plot a subset of the ranks (see rank_points)
+        :max_points: the number of ranks to plot when decimating
+        :counts: the number of times each value occurs, if values is a (value, count) table
         '''
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
-        plt.plot(sorted(values, reverse=True), 'o', color=self.color(color), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
+        ranks, sorted_values = self.rank_points(values, decimate, max_points, xscale, counts=counts)
+        ax.plot(ranks, sorted_values, 'o', color=self.color(color), alpha=alpha)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def multi_rank(self,
                    values_list,
                    title='Rank Plot',
@@ -117,15 +708,23 @@ class Plotter:
                    color=None,
                    alpha=1.,
                    xscale='log',
-                   yscale='log'):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
-        for values in values_list:
-            plt.plot(sorted(values, reverse=True), 'o', color=self.color(color, 'random'), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+                   yscale='log',
+                   decimate=None,
+                   max_points=None):
+        '''
+        Plots several sets of values by rank. Without a color, every set gets its own color,
+        as distinct from the others as possible.
+        '''
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
+        values_list = list(values_list)
+        colors = self.series_colors([color] * len(values_list), ax)
+        for values, series_color in zip(values_list, colors):
+            ranks, sorted_values = self.rank_points(values, decimate, max_points, xscale)
+            ax.plot(ranks, sorted_values, 'o', color=series_color, alpha=alpha)
+        return self._finish(ax.figure, save_path, dpi)
 
 
+    @_plot_method
     def histogram(self,
                   values,
                   title='Histogram',
@@ -139,15 +738,58 @@ class Plotter:
                   xlim=None,
                   xticks=None,
                   xscale=None,
-                  yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim)
-        plt.hist(values, bins=bins, edgecolor='black', color=self.color(color), alpha=alpha)
+                  yscale=None,
+                  bin_range=None,
+                  quantiles=False,
+                  workers=None,
+                  counts=None):
+        '''
+        Plots a histogram of values. The counts are accumulated chunk by chunk, so values can be
+        a column too large for memory or an iterable of chunks (see aggregation.histogram_edges).
+
+        :bins: the number of bins, the bin edges, or a NumPy binning strategy such as 'auto'
+        :bin_range: the (lowest, highest) bin edges; defaults to the range of the values
+        :quantiles: if True, bins hold about equally many values instead of being equally wide
+        :workers: the number of threads to count chunks with
+        :counts: the number of times each value occurs, if values is a (value, count) table
+        '''
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim)
+        with self._phase('aggregate'):
+            edges, counts = self.histogram_counts([values], bins, bin_range, quantiles, workers,
+                                                  None if counts is None else [counts])[0]
+        self._draw_histogram(ax, edges, counts, color=self.color(color), alpha=alpha)
         if xticks:
-            plt.xticks(np.arange(len(values)), xticks)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+            ax.set_xticks(np.arange(len(xticks)), xticks)
+        return self._finish(ax.figure, save_path, dpi)
+
+    def histogram_counts(self, values_list, bins=10, bin_range=None, quantiles=False, workers=None, counts_list=None):
+        '''
+        Bins every series of values_list with one set of shared bin edges.
+
+        :counts_list: the counts of every series, if the series are (value, count) tables
+        :return: a list with the (edges, counts) of each series
+        '''
+        if isinstance(bins, str):
+            if counts_list is not None:
+                raise ValueError('Pass a number of bins or the bin edges to histogram (value, count) tables.')
+            bins = np.histogram_bin_edges(np.concatenate([utils.as_array(values) for values in values_list]), bins)
+        edges = aggregation.histogram_edges(values_list, bins, bin_range, quantiles, weights=counts_list)
+        if counts_list is None:
+            counts_list = [None] * len(values_list)
+        return [(edges, aggregation.histogram_counts(values, edges, workers, weights=counts))
+                for values, counts in zip(values_list, counts_list)]
 
+    def _draw_histogram(self, ax, edges, counts, color, alpha, label=None):
+        '''
+        Draws precomputed histogram counts, as one bar per bin like plt.hist,
+        or as a single outline when there are too many bins for separate bars.
+        '''
+        if len(counts) <= _MAX_HISTOGRAM_BARS:
+            ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', edgecolor='black', color=color, alpha=alpha, label=label)
+        else:
+            ax.stairs(counts, edges, fill=True, edgecolor='black', color=color, alpha=alpha, label=label)
+
+    @_plot_method
     def basic_plot(self,
                    values,
                    title='A simple plot of the points',
@@ -160,12 +802,12 @@ class Plotter:
                    xticks=None,
                    xscale=None,
                    yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
-        plt.plot(values, 'o', color=self.color(color), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+        values = utils.as_array(values)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
+        ax.plot(values, 'o', color=self.color(color), alpha=alpha)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def multi_histogram(self,
                         values_list,
                         title='Histogram',
@@ -178,22 +820,33 @@ class Plotter:
                         colors=None,
                         alphas=None,
                         xscale=None,
-                        yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
+                        yscale=None,
+                        bin_range=None,
+                        quantiles=False,
+                        workers=None,
+                        counts_list=None):
+        '''
+        Plots several histograms over the same bins, so their bars line up and can be compared.
+        The bins, bin_range, quantiles and workers arguments are as for histogram.
+
+        :counts_list: the counts of every series, if the series are (value, count) tables
+        '''
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale)
         #if not utils.check_args(values_list, colors, alphas):
         #    return
         if not alphas:
             alphas = [0.5] * len(values_list)
         if not labels:
             labels = list(str(i) for i in range(1, len(values_list) + 1))
-        for i, values in enumerate(values_list):
+        with self._phase('aggregate'):
+            histograms = self.histogram_counts(values_list, bins, bin_range, quantiles, workers, counts_list)
+        for i, (edges, counts) in enumerate(histograms):
             color = colors[i] if colors else i + 1
-            plt.hist(values, bins=bins, edgecolor='black', color=self.color(color), alpha=alphas[i], label=labels[i])
-        plt.legend(fontsize=16)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+            self._draw_histogram(ax, edges, counts, color=self.color(color), alpha=alphas[i], label=labels[i])
+        ax.legend(fontsize=16)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def loglog(self,
                values,
                title='log-log',
@@ -204,16 +857,18 @@ class Plotter:
                color=None,
                alpha=1.,
                xscale='symlog',
-               yscale='symlog'):
-        self.plot(title=title, xscale=xscale, yscale=yscale)
-        plt.plot(sorted(values, reverse=True), 'o', color=self.color(color), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+               yscale='symlog',
+               decimate=None,
+               max_points=None):
+        ax = self.plot(title=title, xscale=xscale, yscale=yscale)
+        ranks, sorted_values = self.rank_points(values, decimate, max_points, xscale)
+        ax.plot(ranks, sorted_values, 'o', color=self.color(color), alpha=alpha)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def density_scatter(self,
                         x,
-                        y,
+                        y=None,
                         z='heat',
                         title='Density Scatter',
                         save_path=None,
@@ -223,34 +878,52 @@ class Plotter:
                         xscale='symlog',
                         yscale='symlog',
                         vmin=0.0,
-                        vmax=None):
-        #self.plot(title=title, xscale=xscale, yscale=yscale)
-        xy_unique = dict()
-        # count the number of occurrences of each x, y value
-        for _x, _y in zip(x, y):
-            if (_x, _y) not in xy_unique:
-                xy_unique[(_x, _y)] = 0.0
-            xy_unique[(_x, _y)] += 1.0
-        x = list(_x for _x, _ in xy_unique.keys())
-        y = list(_y for _, _y in xy_unique.keys())
+                        vmax=None,
+                        bins=None,
+                        log_bins=True,
+                        counts=None):
+        '''
+        Plots each distinct (x, y) point once, colored (or sized) by how many times it occurs.
+
+        :bins: if None, every distinct (x, y) pair is counted exactly; otherwise the points
+               are aggregated onto a bins x bins grid and one marker is drawn per occupied cell
+        :log_bins: if True, the grid cells are equal width in log space (matches the symlog scales)
+
+        x can also be a Shards of (x, y) pairs (with y left out), which is counted in parallel.
+
+        :counts: the number of times each (x, y) point occurs, if the points are already counted
+        '''
+        # count the number of occurrences of each x, y value (or grid cell)
+        with self._phase('aggregate'):
+            if isinstance(x, Shards):
+                x, y, counts = x.count_pairs()
+            if counts is not None:
+                x, y, z_vals = utils.as_array(x), utils.as_array(y), utils.as_array(counts)
+                if bins:
+                    x, y, z_vals = aggregation.bin_pairs(x, y, bins=bins, log=log_bins, weights=z_vals)
+            elif bins:
+                x, y, z_vals = aggregation.bin_pairs(x, y, bins=bins, log=log_bins)
+            else:
+                x, y, z_vals = aggregation.count_pairs(x, y)
         # the 3rd dimension is the counts
-        z_vals = list(xy_unique.values())
 
-        fig = plt.figure(figsize=(15,10))
-        plt.rc('legend', fontsize=30)
-        ax = fig.add_subplot(1, 1, 1)
-        ax.grid() # TODO: ax.grid(True, linestyle='-', color='0.75'?)
+        if getattr(self._local, 'panel', None) is not None:
+            # a grid panel (see grid), titled like the other panels
+            ax = self.plot(title=title, xlabel='', ylabel='', background='white')
+        else:
+            fig = self.figure((15,10))
+            ax = fig.add_subplot(1, 1, 1)
+            ax.grid() # TODO: ax.grid(True, linestyle='-', color='0.75'?)
         if z == 'heat': # plot density as heat map
             if not vmax:
                 vmax = np.max(z_vals) # make one heat color range to max density
             density = ax.scatter(x, y, s=20, c=z_vals, marker='o', cmap='gist_heat_r', vmin=vmin, vmax=vmax)
         else: # plot density as point size
             density = ax.scatter(x, y, s=z_vals, marker='o')
-        fig.colorbar(density, label='density of points')
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+        ax.figure.colorbar(density, ax=ax, label='density of points')
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def x_vs_y(self,
                x,
                y,
@@ -276,23 +949,63 @@ class Plotter:
                yticks=None,
                xscale=None,
                yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim, grid=grid, background=background)
+        x, y = utils.as_array(x), utils.as_array(y)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim, grid=grid, background=background)
         if with_line:
-            plt.scatter(x, y, color=self.color(colors), alpha=alpha, s=size)
-            plt.plot(x, y, '-', color=self.color(color), alpha=alpha, markersize=size, linewidth=linewidth)
+            ax.scatter(x, y, color=self.color(colors), alpha=alpha, s=size)
+            ax.plot(x, y, '-', color=self.color(color), alpha=alpha, markersize=size, linewidth=linewidth)
         else:
-            scatter_plot = plt.scatter(x, y, color=self.color(colors), alpha=alpha, s=size)
+            scatter_plot = ax.scatter(x, y, color=self.color(colors), alpha=alpha, s=size)
             if legend:
-                plt.legend(handles='l')
+                ax.legend(handles='l')
         if xticks != None:
-            plt.xticks(xticks)
+            ax.set_xticks(xticks)
         if yticks != None:
-            plt.yticks(yticks)
+            ax.set_yticks(yticks)
 
-        if save_path:
-            self.save(save_path, dpi, transparent=transparent)
-        plt.show()
+        return self._finish(ax.figure, save_path, dpi, transparent=transparent)
+
+    @_plot_method
+    def x_vs_y_tiles(self,
+                     pyramid,
+                     title='y = f(x)',
+                     xlabel='x',
+                     ylabel='f(x)',
+                     save_path=None,
+                     dpi=500,
+                     xlim=None,
+                     ylim=None,
+                     pixels=(1500, 1000),
+                     cmap='gist_heat_r',
+                     grid=True,
+                     background='white'):
+        '''
+        Draws a viewport of a scatter pre-aggregated by tiles.TilePyramid.build, as one image read
+        from the zoom level that matches it, so the cost doesn't depend on the number of points.
+
+        :pyramid: a TilePyramid or the directory of one
+        :xlim: the viewport's x range in data coordinates (defaults to the whole pyramid)
+        :pixels: the (width, height) of the image drawn into the axes
+        '''
+        if not isinstance(pyramid, tiles.TilePyramid):
+            pyramid = tiles.TilePyramid(pyramid)
+        x0, x1, y0, y1 = pyramid.bounds
+        xlim, ylim = xlim or (x0, x1), ylim or (y0, y1)
+        with self._phase('aggregate'):
+            image = pyramid.render(xlim, ylim, pixels, cmap)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, grid=grid, background=background)
+        # log pyramids are drawn in symlog space, with ticks labeled in data coordinates
+        extent = np.concatenate([pyramid._transform(np.asarray(xlim, dtype=float)),
+                                 pyramid._transform(np.asarray(ylim, dtype=float))])
+        ax.imshow(image, extent=extent, interpolation='nearest', aspect='auto').set_rasterized(True)
+        if pyramid.log:
+            import matplotlib.ticker
+            formatter = matplotlib.ticker.FuncFormatter(lambda value, _: '{:.3g}'.format(aggregation._symexp(value)))
+            ax.xaxis.set_major_formatter(formatter)
+            ax.yaxis.set_major_formatter(formatter)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def pdf(self,
             data,
             title='pdf',
@@ -306,22 +1019,24 @@ class Plotter:
             xlim=None,
             ylim=None,
             xscale='log',
-            yscale='log'):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
-        counts = defaultdict(int)
-        for x in data:
-            counts[x] += 1
-        x = list()
-        y = list()
-        for d in sorted(list(set(data))):
-            x.append(d)
-            y.append(counts[d])
-        y = np.asarray(y) / np.sum(y)
-        plt.plot(x, y, marker, color=self.color(color), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+            yscale='log',
+            counts=None):
+        '''
+        Plots the empirical probability of each distinct value in data.
+
+        :data: the values, either as an array/list or as an iterable of values or NumPy chunks
+               (e.g. a generator over a large file), which is counted in one streaming pass,
+               or a Shards of files, which are counted in parallel
+        :counts: the number of times each value occurs, if data is a (value, count) table
+        '''
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
+        with self._phase('aggregate'):
+            x, counts = self._counted(data, counts)
+            y = counts / np.sum(counts)
+        ax.plot(x, y, marker, color=self.color(color), alpha=alpha)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def pareto(self,
                data,
                title='pareto',
@@ -335,26 +1050,71 @@ class Plotter:
                xlim=None,
                ylim=None,
                xscale='log',
-               yscale='log'):
-        counts = defaultdict(int)
-        m = np.max(data)
-        for x in data:
-            counts[x] += 1
-        x = list()
-        y = list()
-        s = len(data)
-        for _x in sorted(list(set(data))):
-            x.append(_x)
-            s -= counts[_x]
-            y.append(s)
-
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
-        y = np.asarray(y) / np.sum(y)
-        plt.plot(x, y, marker, color=self.color(color), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+               yscale='log',
+               fit=False,
+               bootstrap=0,
+               workers=None,
+               seed=0,
+               ci=0.95,
+               counts=None):
+        '''
+        Plots the complementary cumulative distribution of data.
+
+        :data: the values, either as an array/list or as an iterable of values or NumPy chunks
+               (e.g. a generator over a large file), which is counted in one streaming pass,
+               or a Shards of files, which are counted in parallel
+        :counts: the number of times each value occurs, if data is a (value, count) table
+        :fit: whether to overlay a maximum-likelihood power-law fit of the tail (see fitting.fit_power_law),
+              or a fitting.PowerLawFit to overlay
+        :bootstrap: the number of bootstrap replicates for a confidence band around the fit
+        :workers: the number of processes to run the replicates on
+        :seed: the seed of the replicates
+        :ci: the confidence level of the band
+        '''
+        with self._phase('aggregate'):
+            x, counts = self._counted(data, counts)
+            # the number of values strictly greater than each distinct value
+            y = np.sum(counts) - np.cumsum(counts)
+            power_law = self._power_law(fit, x, counts, bootstrap, workers, seed, ci)
 
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
+        total = np.sum(y)
+        y = np.asarray(y) / total
+        ax.plot(x, y, marker, color=self.color(color), alpha=alpha)
+        if power_law:
+            # the fit gives P(X >= x), the plot shows the (normalized) number of values > x
+            tail = np.asarray(x[x >= power_law.xmin], dtype=float)
+            above = tail + 1 if power_law.discrete else tail
+            def curve(exponent=None):
+                return power_law.ccdf(above, exponent) * power_law.n / total
+            self._draw_fit(ax, tail, curve, power_law)
+        return self._finish(ax.figure, save_path, dpi)
+
+    def _power_law(self, fit, values, counts, bootstrap, workers, seed, ci):
+        '''
+        :return: fit if it is already a PowerLawFit, a new fit of the counted values if fit is True, or None
+        '''
+        if isinstance(fit, fitting.PowerLawFit):
+            return fit
+        return fitting.fit_power_law(values, counts, bootstrap, workers, seed, ci) if fit else None
+
+    def _draw_fit(self, ax, x, curve, power_law, vertical=False):
+        '''
+        Draws a power-law fit as a line through (x, curve()), with the band between the
+        curves of the ends of its alpha confidence interval if it was bootstrapped.
+        With vertical, the curve gives the x of each point of x instead.
+        '''
+        line = (curve(), x) if vertical else (x, curve())
+        ax.plot(*line, '-', color=self.color(2), linewidth=3, label=power_law.label())
+        if power_law.alpha_ci:
+            low, high = (curve(exponent) for exponent in power_law.alpha_ci)
+            if vertical:
+                ax.fill_betweenx(x, low, high, color=self.color(2), alpha=0.3, linewidth=0)
+            else:
+                ax.fill_between(x, low, high, color=self.color(2), alpha=0.3, linewidth=0)
+        ax.legend(fontsize=26)
+
+    @_plot_method
     def zipf(self,
              data,
              title='zipf',
@@ -368,51 +1128,137 @@ class Plotter:
              xlim=None,
              ylim=None,
              xscale='symlog',
-             yscale='symlog'):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
-        plt.plot(sorted(data, reverse=True), marker, color=self.color(color), alpha=alpha)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+             yscale='symlog',
+             decimate=None,
+             max_points=None,
+             fit=False,
+             bootstrap=0,
+             workers=None,
+             seed=0,
+             ci=0.95,
+             counts=None):
+        '''
+        Plots the values of data by rank, from largest to smallest.
 
+        :counts: the number of times each value occurs, if data is a (value, count) table
+        :fit: whether to overlay a maximum-likelihood power-law fit of the tail (see fitting.fit_power_law),
+              or a fitting.PowerLawFit to overlay
+        :bootstrap: the number of bootstrap replicates for a confidence band around the fit
+        :workers: the number of processes to run the replicates on
+        :seed: the seed of the replicates
+        :ci: the confidence level of the band
+        '''
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
+        power_law = None
+        if fit:
+            # the data is counted once, for both the fit and the ranks
+            with self._phase('aggregate'):
+                data, counts = self._counted(data, counts)
+                power_law = self._power_law(fit, data, counts, bootstrap, workers, seed, ci)
+        ranks, sorted_values = self.rank_points(data, decimate, max_points, xscale, counts=counts)
+        ax.plot(ranks, sorted_values, marker, color=self.color(color), alpha=alpha)
+        if power_law:
+            # about n * P(X >= v) values are >= v, so v sits at that (0-based) rank
+            tail = np.geomspace(power_law.xmin, np.max(data), 200)
+            def curve(exponent=None):
+                return np.maximum(power_law.ccdf(tail, exponent) * power_law.n - 1, 0)
+            self._draw_fit(ax, tail, curve, power_law, vertical=True)
+        return self._finish(ax.figure, save_path, dpi)
+
+    @_plot_method
     def confusion_matrix(self,
                          values,
                          title='Confusion Matrix',
                          cmap='inverted',
                          xlabel=None,
                          ylabel=None,
-                         with_nums=False,
+                         with_nums='auto',
                          save_path=None,
                          dpi=500,
                          names=None,
                          vmin=None,
-                         vmax=None):
-        self.plot(title=title, ylabel='', xlabel='')
-        plt.xlabel(xlabel)
-        sns.set(font_scale=3)
-        sns_plot = sns.heatmap(values,
-                    xticklabels=names,
-                    yticklabels=names,
+                         vmax=None,
+                         as_image=None,
+                         max_cells=1000,
+                         order=None):
+        '''
+        Plots a (square) confusion matrix as a heatmap.
+
+        :values: the matrix, as a dense array or a scipy.sparse matrix
+        :with_nums: whether to write the value in each cell; 'auto' writes them only
+                    when there are at most 100 cells
+        :as_image: whether to draw the matrix as one rasterized image instead of a patch per cell;
+                   defaults to doing so for sparse matrices and matrices of more than 2,500 cells
+        :max_cells: when drawn as an image, classes are summed in blocks so that the image has at
+                    most max_cells cells per side
+        :order: a permutation of the classes to show them in (e.g. to group similar classes)
+        '''
+        import seaborn as sns
+        sparse = hasattr(values, 'tocoo')
+        if not sparse:
+            values = utils.as_array(values)
+        if order is not None:
+            order = np.asarray(order)
+            # COO matrices (the usual format for counts) can't be indexed, so they are reordered as CSR
+            values = values.tocsr()[order][:, order] if sparse else values[np.ix_(order, order)]
+            if names is not None:
+                names = [names[i] for i in order]
+        cells = values.shape[0] * values.shape[1]
+        if as_image is None:
+            as_image = sparse or cells > _MAX_HEATMAP_CELLS
+        if with_nums == 'auto':
+            with_nums = cells <= _MAX_ANNOTATED_CELLS
+        colormap = sns.cm.rocket_r if cmap == 'inverted' else sns.cm.rocket
+        ax = self.plot(title=title, ylabel='', xlabel='', reusable=False)
+        ax.set_xlabel(xlabel)
+        if as_image:
+            self._draw_matrix_image(ax, values, colormap, names, vmin, vmax, max_cells)
+            return self._finish(ax.figure, save_path, dpi)
+        if sparse:
+            values = values.toarray()
+        sns.heatmap(values,
+                    ax=ax,
+                    xticklabels=names if names is not None else 'auto',
+                    yticklabels=names if names is not None else 'auto',
                     vmin=vmin,
                     vmax=vmax,
                     annot=with_nums,
                     cmap=sns.cm.rocket_r if cmap == 'inverted' else None,
                     linewidth=1,
-                    linecolor='black')
-        sns_plot = sns_plot.get_figure()
+                    linecolor='black',
+                    annot_kws={'fontsize': self.fontsize})
+        ax.tick_params(labelsize=self.fontsize)
+        ax.collections[0].colorbar.ax.tick_params(labelsize=self.fontsize)
 
         # from: https://github.com/mwaskom/seaborn/issues/1773
         # fix for mpl bug that cuts off top/bottom of seaborn viz
-        b, t = plt.ylim() # discover the values for bottom and top
+        b, t = ax.get_ylim() # discover the values for bottom and top
         b += 0.5 # Add 0.5 to the bottom
         t -= 0.5 # Subtract 0.5 from the top
-        plt.ylim(b, t) # update the ylim(bottom, top) values
-        plt.show() # ta-da!
+        ax.set_ylim(b, t) # update the ylim(bottom, top) values
+        return self._finish(ax.figure, save_path, dpi)
 
-        if save_path:
-            self.save(save_path, dpi, sns_plot)
-        plt.show()
+    def _draw_matrix_image(self, ax, values, cmap, names, vmin, vmax, max_cells):
+        '''
+        Draws a (possibly sparse) matrix as a single rasterized image, summing blocks of
+        classes when the matrix is larger than max_cells per side.
+        '''
+        rows, cols = values.shape
+        with self._phase('aggregate'):
+            grid, factor = aggregation.block_sum(values, max_cells)
+        image = ax.imshow(grid, cmap=cmap, vmin=vmin, vmax=vmax, interpolation='nearest', aspect='auto',
+                          extent=(-0.5, grid.shape[1] * factor - 0.5, grid.shape[0] * factor - 0.5, -0.5))
+        image.set_rasterized(True)
+        ax.set_xlim(-0.5, cols - 0.5)
+        ax.set_ylim(rows - 0.5, -0.5)
+        if names is not None and factor == 1 and rows <= _MAX_NAMED_TICKS:
+            ax.set_xticks(np.arange(cols), names, rotation=90)
+            ax.set_yticks(np.arange(rows), names)
+        ax.tick_params(labelsize=self.fontsize)
+        colorbar = ax.figure.colorbar(image, ax=ax, label='sum of {0}x{0} blocks'.format(factor) if factor > 1 else None)
+        colorbar.ax.tick_params(labelsize=self.fontsize)
 
+    @_plot_method
     def x_vs_y_with_line(self,
                          x,
                          y,
@@ -426,23 +1272,61 @@ class Plotter:
                          xlim=None,
                          ylim=None,
                          xscale=None,
-                         yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
-        plt.scatter(x, y, color=self.color(color), alpha=alpha)
-        _x = np.log(x) if xscale in {'log', 'symlog'} else x
-        _y = np.log(y) if yscale in {'log', 'symlog'} else y
-        slope, intercept = np.polyfit(_x, _y, deg=1)
-        _x = range(int(round(np.min(x))), int(round(np.max(x)) * 2))
-        _x = np.round(plt.xlim())
-        _y = intercept + slope * np.log(_x) if xscale in {'log', 'symlog'} else intercept + slope * _x
-        if yscale in {'log', 'symlog'}:
-            _y = np.e ** _y
-        plt.plot(_x, _y, color=self.color(color), alpha=alpha, label='slope = {}'.format(round(slope, 2)))
-        plt.legend(fontsize=26)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+                         yscale=None,
+                         bootstrap=0,
+                         workers=None,
+                         seed=0,
+                         ci=0.95,
+                         line=None):
+        '''
+        Plots y against x with a least-squares line (fitted in log space on log axes).
+
+        :bootstrap: the number of bootstrap replicates (over the points) for a confidence band around the line
+        :workers: the number of processes to run the replicates on
+        :seed: the seed of the replicates
+        :ci: the confidence level of the band
+        :line: the (slope, intercept, bootstrap slopes, bootstrap intercepts) of fit_line to draw instead of fitting
+        '''
+        x, y = utils.as_array(x), utils.as_array(y)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
+        ax.scatter(x, y, color=self.color(color), alpha=alpha)
+        log_x, log_y = xscale in {'log', 'symlog'}, yscale in {'log', 'symlog'}
+        if line is None:
+            line = self.fit_line(x, y, xscale, yscale, bootstrap, workers, seed)
+        slope, intercept, slopes, intercepts = line
+        label = 'slope = {}'.format(round(slope, 2))
+        line_x = np.round(ax.get_xlim())
+        if len(slopes):
+            tail = (1 - ci) / 2 * 100
+            low, high = np.percentile(slopes, [tail, 100 - tail])
+            label += ' [{:.2f}, {:.2f}]'.format(low, high)
+            band_x = np.geomspace(*ax.get_xlim(), 100) if log_x else np.linspace(*ax.get_xlim(), 100)
+            predictions = intercepts[:, None] + slopes[:, None] * (np.log(band_x) if log_x else band_x)[None, :]
+            band = np.percentile(predictions, [tail, 100 - tail], axis=0)
+            if log_y:
+                band = np.e ** band
+            ax.fill_between(band_x, band[0], band[1], color=self.color(color), alpha=0.2 * alpha, linewidth=0)
+        line_y = intercept + slope * np.log(line_x) if log_x else intercept + slope * line_x
+        if log_y:
+            line_y = np.e ** line_y
+        ax.plot(line_x, line_y, color=self.color(color), alpha=alpha, label=label)
+        ax.legend(fontsize=26)
+        return self._finish(ax.figure, save_path, dpi)
 
+    def fit_line(self, x, y, xscale=None, yscale=None, bootstrap=0, workers=None, seed=0):
+        '''
+        Fits a least-squares line to the points, in log space along log scales.
+
+        :return: the slope, the intercept and the slopes and intercepts of the bootstrap replicates
+        '''
+        x = np.log(x) if xscale in {'log', 'symlog'} else x
+        y = np.log(y) if yscale in {'log', 'symlog'} else y
+        with self._phase('aggregate'):
+            slope, intercept = np.polyfit(x, y, deg=1)
+            slopes, intercepts = fitting.bootstrap_linear_fit(x, y, bootstrap, workers, seed)
+        return slope, intercept, slopes, intercepts
+
+    @_plot_method
     def x_vs_y_with_log_func(self,
                              x,
                              y,
@@ -457,22 +1341,23 @@ class Plotter:
                              ylim=None,
                              xscale=None,
                              yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
-        plt.scatter(x, y, color=self.color(color), alpha=alpha)
-        slope, intercept = np.polyfit(np.log(x), y, 1)
-        _x = range(1, int(np.ceil(plt.xlim()[1])))
+        x, y = utils.as_array(x), utils.as_array(y)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
+        ax.scatter(x, y, color=self.color(color), alpha=alpha)
+        with self._phase('aggregate'):
+            slope, intercept = np.polyfit(np.log(x), y, 1)
+        _x = range(1, int(np.ceil(ax.get_xlim()[1])))
         _y = intercept + slope * np.log(_x)#* np.log(_x) if xscale in {'log', 'symlog'} else intercept + slope * _x
         #if yscale in {'log', 'symlog'}:
         #    _y = np.e ** _y
         print(slope, intercept)
 
-        plt.plot(_x, _y, '-', color=self.color(color), alpha=alpha, label='exp = {}'.format(round(slope, 2)))
-        #plt.legend(fontsize=16)
-        plt.legend(fontsize=16)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+        ax.plot(_x, _y, '-', color=self.color(color), alpha=alpha, label='exp = {}'.format(round(slope, 2)))
+        #ax.legend(fontsize=16)
+        ax.legend(fontsize=16)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def x_vs_y_multiple(self,
                         xs,
                         ys,
@@ -499,30 +1384,31 @@ class Plotter:
                         linewidth=None,
                         xscale=None,
                         yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim, grid=grid, background=background)
+        xs, ys = [utils.as_array(x) for x in xs], [utils.as_array(y) for y in ys]
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim, grid=grid, background=background)
+        colors = self.series_colors(colors if colors else [None] * len(xs), ax)
         if with_line:
             if line_styles == None:
                 line_styles = ['-'] * len(colors)
             if markers == None:
                 markers = ['-o'] * len(colors)
             for x, y, label, color, line_style, marker in zip(xs, ys, labels, colors, line_styles, markers):
-                plt.plot(x, y, marker, markersize=size, label=label, linewidth=linewidth, color=self.color('random') if not color else color, alpha=alpha, linestyle=line_style)
+                ax.plot(x, y, marker, markersize=size, label=label, linewidth=linewidth, color=color, alpha=alpha, linestyle=line_style)
         else:
             for x, y, label, color in zip(xs, ys, labels, colors):
-                plt.scatter(x, y, s=size, label=label, color=self.color('random') if not color else color, alpha=alpha)
+                ax.scatter(x, y, s=size, label=label, color=color, alpha=alpha)
         if xticks != None:
-            plt.xticks(xticks)
+            ax.set_xticks(xticks)
         if yticks != None:
-            plt.yticks(yticks)
+            ax.set_yticks(yticks)
             if ytick_labels != None:
-                plt.yticks(yticks, ytick_labels)
+                ax.set_yticks(yticks, ytick_labels)
 
         if legend:
-            plt.legend(fontsize=self.fontsize)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+            ax.legend(fontsize=self.fontsize)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def x_vs_y_with_y_eq_x(self,
                            x,
                            y,
@@ -537,18 +1423,18 @@ class Plotter:
                            ylim=None,
                            xscale=None,
                            yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
-        plt.scatter(x, y, color=self.color(color), alpha=alpha)
+        x, y = utils.as_array(x), utils.as_array(y)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim, ylim=ylim)
+        ax.scatter(x, y, color=self.color(color), alpha=alpha)
         slope, intercept = (1, 0)
         _x = range(round(np.min(x)), round(np.max(x)) * 2)
-        _x = np.round(plt.xlim())
+        _x = np.round(ax.get_xlim())
         _y = intercept + slope * np.log(_x) if xscale in {'log', 'symlog'} else intercept + slope * _x
-        plt.plot(_x, np.e ** _y, color=self.color(color), alpha=alpha, label='{} = {}'.format(ylabel, xlabel))
-        plt.legend(fontsize=16)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+        ax.plot(_x, np.e ** _y, color=self.color(color), alpha=alpha, label='{} = {}'.format(ylabel, xlabel))
+        ax.legend(fontsize=16)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def bar(self,
             x,
             y,
@@ -563,17 +1449,17 @@ class Plotter:
             xticks=None,
             xscale=None,
             yscale=None):
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim)
-        plt.bar(x, y, color=self.color(color), alpha=alpha)
+        x, y = utils.as_array(x), utils.as_array(y)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, yscale=yscale, xlim=xlim)
+        ax.bar(x, y, color=self.color(color), alpha=alpha)
         if xticks:
-            plt.xticks(np.arange(1, len(x) + 1), xticks, rotation=90)
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+            ax.set_xticks(np.arange(1, len(x) + 1), xticks, rotation=90)
+        return self._finish(ax.figure, save_path, dpi)
 
+    @_plot_method
     def timeline(self,
                  x,
-                 t,
+                 t=None,
                  start=1,
                  title='Timeline',
                  xlabel='Time',
@@ -587,47 +1473,295 @@ class Plotter:
                  top_line=True,
                  with_last=True,
                  xlim=None,
-                 xscale=None):
+                 xscale=None,
+                 bins=None):
+        '''
+        Plots events along a timeline from start to t.
+
+        :x: the times of the events, or an aggregation.TimelineCounts (which gives t and start)
+        :t: the end of the timeline (defaults to the last event)
+        :with_dots: if True, stacks one dot per event above its time (or, when aggregated,
+                    draws a line as high as the number of events in each bin)
+        :bins: if given, events are counted into this many time bins and the figure keeps a
+               constant size, so horizons of millions of steps and events stay cheap to draw.
+               Keep a TimelineCounts and add() new events to it to update a live timeline.
+        '''
         if color == None:
             color = 'green'
-        if with_dots:
-            x_to_c = defaultdict(int)
-            for _x in x:
-                x_to_c[_x] += 1
-            x = sorted(set(x))
-            m = max(x_to_c.values())
+        if not isinstance(x, aggregation.TimelineCounts) and t is None:
+            x = utils.as_array(x)
+            t = np.max(x) if len(x) else start
+        if isinstance(x, aggregation.TimelineCounts):
+            timeline = x
+        elif bins:
+            with self._phase('aggregate'):
+                timeline = aggregation.TimelineCounts(t, start=start, bins=bins).add(x)
+        else:
+            timeline = None
+        if timeline is not None:
+            t, start = timeline.t, timeline.start
+            occupied = np.flatnonzero(timeline.counts)
+            x = timeline.centers()[occupied]
+            x_counts = timeline.counts[occupied]
+            size = (15, 3) if with_dots else (15, 1)
+        elif with_dots:
+            x, x_counts = np.unique(utils.as_array(x), return_counts=True)
+            m = np.max(x_counts)
             size = (t, m)
         else:
+            x = utils.as_array(x)
             size = (15, 1)
 
-        self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, xlim=xlim, size=size, background='white', grid=False, top_line=top_line)
+        ax = self.plot(title=title, xlabel=xlabel, ylabel=ylabel, xscale=xscale, xlim=xlim, size=size, background='white', grid=False, top_line=top_line)
         
-        xs = np.arange(start, t + 1)
-        ys = [0] * len(xs)
-        plt.plot(xs, ys, color='black')
+        ax.plot([start, t], [0, 0], color='black')
 
-        xticks = [1] + list(np.arange(start, t + 1, interval) - 1)[1:]
-        if with_last and xticks[-1] != xs[-1]:
-            xticks.append(xs[-1])
-        plt.xticks(xticks)
+        # explicit ticks every interval, unless there would be too many to read
+        if timeline is None or (t - start) / interval <= 50:
+            xticks = [1] + list(np.arange(start, t + 1, interval) - 1)[1:]
+            if with_last and xticks[-1] != t:
+                xticks.append(t)
+            ax.set_xticks(xticks)
 
-        y = [0] * len(x)
-        plt.scatter(x, y, marker='|', s=500, color=color)
+        y = np.zeros(len(x))
+        ax.scatter(x, y, marker='|', s=500, color=color)
 
-        if with_dots:
-            x_dots = list()
-            y_dots = list()
-            for _x in x:
-                for c in range(1, x_to_c[_x] + 1):
-                    x_dots.append(_x)
-                    y_dots.append(c)
-            plt.scatter(x_dots, y_dots, marker='o', s=40, color=color)
+        if with_dots and timeline is not None:
+            ax.vlines(x, 0, x_counts, color=color)
+            ax.scatter(x, x_counts, marker='o', s=40, color=color)
+        elif with_dots:
+            # one dot at heights 1, ..., count above each time
+            x_dots = np.repeat(x, x_counts)
+            y_dots = np.arange(1, len(x_dots) + 1) - np.repeat(np.cumsum(x_counts) - x_counts, x_counts)
+            ax.scatter(x_dots, y_dots, marker='o', s=40, color=color)
 
-        plt.xlabel('Time')
+        ax.set_xlabel('Time')
 
         # remove yticks
-        frame1 = plt.gca()
-        frame1.axes.yaxis.set_ticklabels([])
-        if save_path:
-            self.save(save_path, dpi)
-        plt.show()
+        ax.yaxis.set_ticklabels([])
+        return self._finish(ax.figure, save_path, dpi)
+
+
+def _pdf_points(data, decimate=None, max_points=None, log=True):
+    x, counts = aggregation.count_values(data)
+    return x, counts / np.sum(counts)
+
+
+def _pareto_points(data, decimate=None, max_points=None, log=True):
+    x, counts = aggregation.count_values(data)
+    y = np.sum(counts) - np.cumsum(counts)
+    return x, y / np.sum(y)
+
+
+# the kinds of animation: how a snapshot becomes points, and the default title, labels and scales
+_ANIMATIONS = {'pdf': (_pdf_points, 'pdf', 'x', 'p(x)', 'log', 'log'),
+               'pareto': (_pareto_points, 'pareto', 'x', 'p(deg >= x)', 'log', 'log'),
+               'rank': (aggregation.rank_points, 'Rank Plot', 'rank of values', 'value', 'log', 'log'),
+               'zipf': (aggregation.rank_points, 'zipf', 'rank', 'val', 'symlog', 'symlog')}
+
+
+def _compute_counts(plotter, method, data, counts=None):
+    values, counts = plotter._counted(data, counts)
+    return PlotData(method, {'values': values, 'counts': counts})
+
+
+def _render_counts(plotter, plot_data, kwargs):
+    return getattr(plotter, plot_data.method)(plot_data['values'], counts=plot_data['counts'], **kwargs)
+
+
+def _compute_power_law(plotter, method, data, counts=None, fit=False, bootstrap=0, workers=None, seed=0, ci=0.95):
+    plot_data = _compute_counts(plotter, method, data, counts)
+    power_law = plotter._power_law(fit, plot_data['values'], plot_data['counts'], bootstrap, workers, seed, ci)
+    if power_law:
+        plot_data.meta['fit'] = power_law.as_dict()
+        plot_data.arrays.update(fit_alphas=power_law.alphas, fit_xmins=power_law.xmins)
+    return plot_data
+
+
+def _render_power_law(plotter, plot_data, kwargs):
+    fit = False
+    if 'fit' in plot_data.meta:
+        fit = fitting.PowerLawFit(alphas=plot_data['fit_alphas'], xmins=plot_data['fit_xmins'], **plot_data.meta['fit'])
+    return getattr(plotter, plot_data.method)(plot_data['values'], counts=plot_data['counts'], fit=fit, **kwargs)
+
+
+def _compute_histogram(plotter, method, values, bins=10, bin_range=None, quantiles=False, workers=None, counts=None):
+    return _compute_histograms(plotter, method, [values], bins, bin_range, quantiles, workers,
+                               None if counts is None else [counts])
+
+
+def _compute_histograms(plotter, method, values_list, bins=10, bin_range=None, quantiles=False, workers=None, counts_list=None):
+    histograms = plotter.histogram_counts(values_list, bins, bin_range, quantiles, workers, counts_list)
+    return PlotData(method, {'edges': histograms[0][0], 'counts': np.array([counts for _, counts in histograms])})
+
+
+def _render_histograms(plotter, plot_data, kwargs):
+    edges, counts = plot_data['edges'], plot_data['counts']
+    # the bin centers, weighted by the counts, fall back into the same bins
+    centers = (edges[:-1] + edges[1:]) / 2
+    if plot_data.method == 'histogram':
+        return plotter.histogram(centers, counts=counts[0], bins=edges, **kwargs)
+    return plotter.multi_histogram([centers] * len(counts), counts_list=list(counts), bins=edges, **kwargs)
+
+
+def _compute_pairs(plotter, method, x, y=None, bins=None, log_bins=True):
+    if isinstance(x, Shards):
+        x, y, counts = x.count_pairs()
+        if bins:
+            x, y, counts = aggregation.bin_pairs(x, y, bins=bins, log=log_bins, weights=counts)
+    elif bins:
+        x, y, counts = aggregation.bin_pairs(x, y, bins=bins, log=log_bins)
+    else:
+        x, y, counts = aggregation.count_pairs(x, y)
+    return PlotData(method, {'x': x, 'y': y, 'counts': counts})
+
+
+def _render_pairs(plotter, plot_data, kwargs):
+    return plotter.density_scatter(plot_data['x'], plot_data['y'], counts=plot_data['counts'], **kwargs)
+
+
+def _compute_line(plotter, method, x, y, xscale=None, yscale=None, bootstrap=0, workers=None, seed=0):
+    x, y = utils.as_array(x), utils.as_array(y)
+    slope, intercept, slopes, intercepts = plotter.fit_line(x, y, xscale, yscale, bootstrap, workers, seed)
+    return PlotData(method, {'x': x, 'y': y, 'slopes': slopes, 'intercepts': intercepts},
+                    {'slope': float(slope), 'intercept': float(intercept), 'xscale': xscale, 'yscale': yscale})
+
+
+def _render_line(plotter, plot_data, kwargs):
+    meta = plot_data.meta
+    kwargs = dict({'xscale': meta['xscale'], 'yscale': meta['yscale']}, **kwargs)
+    line = (meta['slope'], meta['intercept'], plot_data['slopes'], plot_data['intercepts'])
+    return plotter.x_vs_y_with_line(plot_data['x'], plot_data['y'], line=line, **kwargs)
+
+
+# the plot methods that can be computed and rendered separately: method -> (compute, render)
+_STAGES = {'pdf': (_compute_counts, _render_counts),
+           'rank': (_compute_counts, _render_counts),
+           'pareto': (_compute_power_law, _render_power_law),
+           'zipf': (_compute_power_law, _render_power_law),
+           'histogram': (_compute_histogram, _render_histograms),
+           'multi_histogram': (_compute_histograms, _render_histograms),
+           'density_scatter': (_compute_pairs, _render_pairs),
+           'x_vs_y_with_line': (_compute_line, _render_line)}
+
+
+def _count_panel(args, counts=None):
+    if counts is None:
+        values, counts = aggregation.count_values(args[0])
+    else:
+        values, counts = aggregation.value_counts(args[0], counts)
+    return (values,), {'counts': counts}
+
+# the plot methods whose grid panels are counted in parallel before drawing, and how
+_PANEL_AGGREGATES = {'pdf': _count_panel, 'pareto': _count_panel, 'rank': _count_panel, 'zipf': _count_panel}
+
+# argument -> the function that keys it in the render cache, per method
+_CACHE_FINGERPRINTS = {'x_vs_y_tiles': {'pyramid': tiles.fingerprint}}
+
+_MAX_PENDING_SAVES = 16
+
+# rank plots of shards with more values than this are decimated by default
+_MAX_EXACT_RANKS = 10 ** 6
+
+# the formats that draw artists as vectors, in which dense layers are rasterized
+_VECTOR_FORMATS = {'pdf', 'svg', 'eps', 'ps'}
+
+# the extensions save accepts
+_SAVE_FORMATS = {'jpg', 'png'} | _VECTOR_FORMATS
+
+# histograms with more bins than this are drawn as one outline instead of a bar per bin
+_MAX_HISTOGRAM_BARS = 200
+
+# confusion matrices with more cells than this are drawn as an image instead of a patch per cell
+_MAX_HEATMAP_CELLS = 2500
+# cells are annotated by default only up to this many cells
+_MAX_ANNOTATED_CELLS = 100
+# class names are only written on the ticks up to this many classes
+_MAX_NAMED_TICKS = 100
+
+def _tight_bbox(fig, dpi):
+    '''
+    Lays out fig at dpi and computes the bounding box that bbox_inches='tight' would save.
+    '''
+    import matplotlib
+    figure_dpi = fig.dpi
+    fig.dpi = dpi
+    try:
+        fig.draw_without_rendering()
+        return fig.get_tightbbox().padded(matplotlib.rcParams['savefig.pad_inches'])
+    finally:
+        fig.dpi = figure_dpi
+
+
+@contextlib.contextmanager
+def _rasterize_dense(fig, max_points, max_artists, vector=True):
+    '''
+    Marks the data artists of fig to be rasterized in vector output if one of them has more
+    than max_points points or there are more than max_artists of them, and unmarks them on
+    exit, so that the figure is left as it was for later saves.
+
+    :vector: whether there is vector output to write at all (if not, nothing is marked)
+    :return: a context that gives whether anything will be rasterized
+    '''
+    rasterized, marked = False, list()
+    for ax in fig.axes if vector else ():
+        artists = list(ax.lines) + list(ax.collections) + list(ax.patches) + list(ax.images)
+        every = max_artists is not None and len(artists) > max_artists
+        for artist in artists:
+            if not artist.get_rasterized() and (every or (max_points is not None and artist_points(artist) > max_points)):
+                artist.set_rasterized(True)
+                marked.append(artist)
+            rasterized = rasterized or artist.get_rasterized()
+    try:
+        yield rasterized
+    finally:
+        for artist in marked:
+            artist.set_rasterized(False)
+
+
+def _write_figure(fig, targets, transparent=False, record=None, rasterize=(None, None, None)):
+    '''
+    Writes one figure to several (path, dpi) targets. The tight bounding box is computed
+    once and reused, rather than laid out again for every file. Vector targets get their
+    dense data layers rasterized as rasterize = (max points, max artists, dpi) describes.
+    '''
+    bbox_inches = _tight_bbox(fig, targets[0][1])
+    if record is not None:
+        record.lap('layout')
+    vector = [path for path, _ in targets if path.split('.')[-1] in _VECTOR_FORMATS]
+    with _rasterize_dense(fig, *rasterize[:2], vector=bool(vector)) as rasterized:
+        if rasterized:
+            targets = [(path, rasterize[2] if path in vector else dpi) for path, dpi in targets]
+        for path, dpi in targets:
+            fig.savefig(path, format=path.split('.')[-1], dpi=dpi, bbox_inches=bbox_inches, transparent=transparent)
+            if record is not None:
+                record.lap('encode')
+                record.bytes += os.path.getsize(path)
+
+
+def _job_spec(job):
+    if isinstance(job, dict):
+        method, data, kwargs, save_path = job['method'], job.get('data', ()), job.get('kwargs'), job.get('save_path')
+    else:
+        method, data, kwargs, save_path = job
+    if not isinstance(data, tuple):
+        data = (data,)
+    return method, data, dict(kwargs) if kwargs else dict(), save_path
+
+
+_worker_plotter = None
+
+def _init_worker(fontsize, theme):
+    global _worker_plotter
+    _worker_plotter = Plotter(fontsize=fontsize, theme=theme, pyplot=False)
+
+
+def _render_job(job):
+    method, data, kwargs, save_path = job
+    start = time.perf_counter()
+    error = None
+    try:
+        getattr(_worker_plotter, method)(*data, save_path=save_path, **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    return {'method': method, 'save_path': save_path, 'time': time.perf_counter() - start, 'error': error}
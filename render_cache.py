@@ -0,0 +1,178 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+class RenderCache:
+    '''
+    A size-bounded LRU cache of rendered images, kept in memory and optionally on disk.
+    Entries are keyed by hash_key, which fingerprints everything that goes into a plot.
+    '''
+    def __init__(self, max_bytes=256 * 2 ** 20, directory=None, max_disk_bytes=2 * 2 ** 30):
+        '''
+        :max_bytes: the maximum total size of the images kept in memory
+        :directory: a directory to also keep images in, so that they survive restarts
+        :max_disk_bytes: the maximum total size of the images kept in directory
+        '''
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict() # key -> image, least recently used first
+        self._memory_bytes = 0
+        self._disk = OrderedDict() # key -> file size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            entries = [entry for entry in os.scandir(directory) if entry.name.endswith('.img')]
+            for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                self._disk[entry.name[:-4]] = entry.stat().st_size
+                self._disk_bytes += entry.stat().st_size
+
+    def get(self, key):
+        '''
+        :return: the cached image for key, or None if there isn't one
+        '''
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if key in self._disk:
+                path = self._path(key)
+                try:
+                    with open(path, 'rb') as f:
+                        image = f.read()
+                    os.utime(path)
+                except OSError:
+                    self._forget_file(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self._remember(key, image)
+                    self.hits += 1
+                    return image
+            self.misses += 1
+            return None
+
+    def put(self, key, image):
+        with self._lock:
+            self._remember(key, image)
+            if self.directory and key not in self._disk:
+                with open(self._path(key), 'wb') as f:
+                    f.write(image)
+                self._disk[key] = len(image)
+                self._disk_bytes += len(image)
+                while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                    oldest = next(iter(self._disk))
+                    try:
+                        os.remove(self._path(oldest))
+                    except OSError:
+                        pass
+                    self._forget_file(oldest)
+
+    def clear(self):
+        '''
+        Empties the cache, including its directory, and resets the counters.
+        '''
+        with self._lock:
+            for key in list(self._disk):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._memory.clear()
+            self._disk.clear()
+            self._memory_bytes = self._disk_bytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._memory),
+                'bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.img')
+
+    def _remember(self, key, image):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        if len(image) > self.max_bytes:
+            return
+        self._memory[key] = image
+        self._memory_bytes += len(image)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget_file(self, key):
+        self._disk_bytes -= self._disk.pop(key)
+
+
+class Unhashable(Exception):
+    pass
+
+
+def hash_key(*parts):
+    '''
+    Fingerprints the given parts (arrays, sparse matrices, lists, dicts, strings and numbers) with blake2b.
+    Arrays are hashed from their raw buffer, so this is fast even for large inputs.
+
+    :return: the hex digest, or None if some part can't be fingerprinted (e.g. a generator)
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        for part in parts:
+            _update(digest, part)
+    except Unhashable:
+        return None
+    return digest.hexdigest()
+
+
+def _update(digest, value):
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        digest.update(repr(value).encode())
+    elif isinstance(value, (np.ndarray, np.generic)):
+        value = np.asarray(value)
+        if value.dtype == object:
+            _update(digest, value.tolist())
+            return
+        digest.update('{}{}'.format(value.dtype.str, value.shape).encode())
+        digest.update(memoryview(np.ascontiguousarray(value)).cast('B'))
+    elif hasattr(value, 'tocsr'): # scipy.sparse
+        value = value.tocsr()
+        digest.update('sparse{}'.format(value.shape).encode())
+        for array in (value.data, value.indices, value.indptr):
+            _update(digest, array)
+    elif isinstance(value, (list, tuple)):
+        array = None
+        if value and not isinstance(value[0], (list, tuple, np.ndarray)):
+            try:
+                array = np.asarray(value)
+            except ValueError: # ragged, e.g. ranges of different lengths
+                pass
+        if array is not None and array.dtype != object and array.dtype.kind != 'U':
+            # the item types too, since np.asarray makes [True, 2] and [1, 2] the same array
+            types = sorted({type(item).__name__ for item in value})
+            digest.update('{}{}'.format(type(value).__name__, types).encode())
+            _update(digest, array)
+            return
+        digest.update('{}{}('.format(type(value).__name__, len(value)).encode())
+        for item in value:
+            _update(digest, item)
+        digest.update(b')')
+    elif isinstance(value, dict):
+        digest.update('dict{}('.format(len(value)).encode())
+        for k in sorted(value, key=repr):
+            _update(digest, k)
+            _update(digest, value[k])
+        digest.update(b')')
+    else:
+        raise Unhashable(type(value))
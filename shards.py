@@ -0,0 +1,121 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+import aggregation
+import utils
+
+
+class Shards:
+    '''
+    A dataset split across many files (or other pieces), which Plotter methods count shard by
+    shard in a pool of processes. Every worker sends back compact (value, count) arrays instead
+    of the values themselves, and these are merged pairwise in a tree.
+    '''
+    def __init__(self, paths, loader=None, workers=None):
+        '''
+        :paths: the shards, as file paths or anything else the loader accepts
+        :loader: a function from a shard to its values, or to its (x, y) values for density_scatter;
+                 it must be picklable (defined at the top level of a module) to run in other
+                 processes. Defaults to load_shard.
+        :workers: the number of processes (defaults to the number of cores; 1 counts in this process)
+        '''
+        self.paths = list(paths)
+        self.loader = loader
+        self.workers = workers
+
+    def __len__(self):
+        return len(self.paths)
+
+    def count_values(self):
+        '''
+        :return: the sorted distinct values of all the shards and their counts
+        '''
+        return self._reduce('values')
+
+    def count_pairs(self):
+        '''
+        :return: the distinct (x, y) pairs of all the shards, as x values, y values and counts
+        '''
+        if not self.paths:
+            return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+        pairs, counts = self._reduce('pairs')
+        return pairs['x'], pairs['y'], counts
+
+    def _reduce(self, kind):
+        workers = min(self.workers or os.cpu_count(), max(1, len(self.paths)))
+        if workers <= 1:
+            return tree_merge([_count_batch(self.loader, self.paths, kind)])
+        # a few batches of shards per worker, each merged in its worker before it is sent back
+        batches = [batch for batch in np.array_split(np.arange(len(self.paths)), 4 * workers) if len(batch)]
+        batches = [[self.paths[i] for i in batch] for batch in batches]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_count_batch, [self.loader] * len(batches), batches, [kind] * len(batches)))
+            return tree_merge(parts, pool)
+
+
+def load_shard(path):
+    '''
+    Loads one shard file: a .npy file (memory-mapped), a .npz file, a Parquet file (with pyarrow)
+    or a text file of numbers. Files with two columns (or the arrays 'x' and 'y' of a .npz file)
+    are returned as an (x, y) pair.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        data = np.load(path, mmap_mode='r')
+    elif extension == '.npz':
+        with np.load(path) as arrays:
+            if 'x' in arrays and 'y' in arrays:
+                return arrays['x'], arrays['y']
+            data = arrays[arrays.files[0]]
+    elif extension == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, memory_map=True)
+        columns = [utils.as_array(column) for column in table.columns]
+        return (columns[0], columns[1]) if len(columns) == 2 else columns[0]
+    else:
+        data = np.loadtxt(path, ndmin=1)
+    if data.ndim == 2 and data.shape[1] == 2:
+        return data[:, 0], data[:, 1]
+    return data
+
+
+def _count_shard(data, kind):
+    if kind == 'values':
+        return aggregation.count_values(data)
+    x, y = data if isinstance(data, tuple) else (data[:, 0], data[:, 1])
+    x, y, counts = aggregation.count_pairs(x, y)
+    # a common dtype, so that the pairs of every shard can be merged
+    dtype = [(name, np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64)
+             for name, values in (('x', x), ('y', y))]
+    pairs = np.empty(len(x), dtype=dtype)
+    pairs['x'], pairs['y'] = x, y
+    return pairs, counts
+
+
+def _count_batch(loader, paths, kind):
+    return tree_merge([_count_shard((loader or load_shard)(path), kind) for path in paths])
+
+
+def _merge_two(parts):
+    (values_a, counts_a), (values_b, counts_b) = parts
+    return aggregation.merge_counts(values_a, counts_a, values_b, counts_b)
+
+
+def tree_merge(parts, pool=None):
+    '''
+    Merges a list of (distinct values, counts) pairs two by two, level by level, so that every
+    value is merged about log2(len(parts)) times; the merges of a level run in pool if given.
+
+    :return: the sorted distinct values of all the parts and their summed counts
+    '''
+    if not parts:
+        return np.unique(np.empty(0), return_counts=True)
+    while len(parts) > 1:
+        pairs = [(parts[i], parts[i + 1]) for i in range(0, len(parts) - 1, 2)]
+        merged = list(pool.map(_merge_two, pairs)) if pool else [_merge_two(pair) for pair in pairs]
+        if len(parts) % 2:
+            merged.append(parts[-1])
+        parts = merged
+    return parts[0]
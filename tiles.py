@@ -0,0 +1,334 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import io
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+
+import aggregation
+import utils
+
+
+class TilePyramid:
+    '''
+    Pre-aggregated (x, y) points for drawing scatters too large to plot point by point.
+    Level z is a (tile_size * 2^z)^2 grid of point counts (and optionally of the sums of a
+    value to color by), stored as memory-mapped files, so that any tile or viewport is drawn
+    by reading only the cells it shows, whatever the number of points.
+    '''
+    def __init__(self, directory):
+        '''
+        Opens a pyramid written by TilePyramid.build.
+        '''
+        self.directory = directory
+        with open(os.path.join(directory, 'pyramid.json')) as f:
+            self.meta = json.load(f)
+        self.levels = self.meta['levels']
+        self.tile_size = self.meta['tile_size']
+        self.bounds = tuple(self.meta['bounds'])
+        self.log = self.meta['log']
+        self.has_values = self.meta['value_range'] is not None
+        self._grids = dict()
+
+    @classmethod
+    def build(cls, x, y, directory, values=None, levels=6, tile_size=256, bounds=None, log=False, chunk_size=1 << 20):
+        '''
+        Counts the points into every level of a new pyramid in directory, in one pass over the
+        points (two if bounds isn't given); memory stays bounded by the chunk size.
+
+        :x: the x values, as a column (e.g. a memmap, an Arrow ChunkedArray or a pandas Series) or a list
+        :y: the y values
+        :values: an optional value per point; cells are then colored by the mean value of their points
+        :levels: the number of zoom levels; the finest has (tile_size * 2^(levels - 1))^2 cells
+        :bounds: the (x0, x1, y0, y1) the pyramid covers (defaults to the range of the points)
+        :log: if True, cells are equal width in symlog space, like density_scatter's log bins
+        :return: the TilePyramid
+        '''
+        os.makedirs(directory, exist_ok=True)
+        transform = aggregation._symlog if log else (lambda v: np.asarray(v, dtype=float))
+        def chunks():
+            return _aligned_chunks([x, y] if values is None else [x, y, values], chunk_size)
+        if bounds is None:
+            lo, hi = np.full(2, np.inf), np.full(2, -np.inf)
+            for chunk in chunks():
+                for axis in range(2):
+                    if len(chunk[axis]):
+                        lo[axis] = min(lo[axis], np.min(chunk[axis]))
+                        hi[axis] = max(hi[axis], np.max(chunk[axis]))
+            bounds = (lo[0], hi[0], lo[1], hi[1])
+        bounds = tuple(float(b) for b in bounds)
+        t = transform(np.array(bounds))
+        # the extent in transformed space; a single distinct value gets a cell of its own
+        extent = [t[0], t[1] if t[1] > t[0] else t[0] + 1, t[2], t[3] if t[3] > t[2] else t[2] + 1]
+
+        n = tile_size * 2 ** (levels - 1)
+        counts = _open_grid(directory, levels - 1, 'counts', np.uint32, n, 'w+')
+        sums = _open_grid(directory, levels - 1, 'values', np.float64, n, 'w+') if values is not None else None
+        value_range = [np.inf, -np.inf]
+        flat_counts = counts.reshape(-1)
+        flat_sums = sums.reshape(-1) if sums is not None else None
+        for chunk in chunks():
+            col, row = _cells(transform(chunk[0]), transform(chunk[1]), extent, n)
+            inside = (col >= 0) & (col < n) & (row >= 0) & (row < n)
+            cells = row[inside] * n + col[inside]
+            occupied, inverse, cell_counts = np.unique(cells, return_inverse=True, return_counts=True)
+            # the cells are distinct, so plain fancy indexing adds every count once
+            flat_counts[occupied] += cell_counts.astype(np.uint32)
+            if sums is not None:
+                chunk_values = np.asarray(chunk[2], dtype=float)[inside]
+                flat_sums[occupied] += np.bincount(inverse.ravel(), weights=chunk_values, minlength=len(occupied))
+                if len(chunk_values):
+                    value_range = [min(value_range[0], np.min(chunk_values)), max(value_range[1], np.max(chunk_values))]
+
+        maxima = [0] * levels
+        maxima[levels - 1] = int(_block_max(counts))
+        for z in range(levels - 2, -1, -1):
+            counts = _downsample(counts, _open_grid(directory, z, 'counts', np.uint32, n // 2 ** (levels - 1 - z), 'w+'))
+            maxima[z] = int(_block_max(counts))
+            if sums is not None:
+                sums = _downsample(sums, _open_grid(directory, z, 'values', np.float64, n // 2 ** (levels - 1 - z), 'w+'))
+        counts.flush()
+
+        meta = {'build': uuid.uuid4().hex,
+                'levels': levels,
+                'tile_size': tile_size,
+                'bounds': list(bounds),
+                'extent': [float(e) for e in extent],
+                'log': log,
+                'max_counts': maxima,
+                'value_range': [float(v) for v in value_range] if sums is not None else None}
+        with open(os.path.join(directory, 'pyramid.json'), 'w') as f:
+            json.dump(meta, f)
+        return cls(directory)
+
+    def grid(self, z, name='counts'):
+        '''
+        :return: the (read-only, memory-mapped) grid of level z, with row 0 at the top (largest y)
+        '''
+        if (z, name) not in self._grids:
+            dtype = np.uint32 if name == 'counts' else np.float64
+            self._grids[z, name] = _open_grid(self.directory, z, name, dtype, self.tile_size * 2 ** z, 'r')
+        return self._grids[z, name]
+
+    def tile(self, z, tx, ty, cmap='gist_heat_r'):
+        '''
+        :return: tile (tx, ty) of level z (with ty = 0 at the top) as a (tile_size, tile_size, 4) RGBA array
+        '''
+        if not (0 <= z < self.levels and 0 <= tx < 2 ** z and 0 <= ty < 2 ** z):
+            raise ValueError('There is no tile {}/{}/{}.'.format(z, tx, ty))
+        cells = np.s_[ty * self.tile_size:(ty + 1) * self.tile_size, tx * self.tile_size:(tx + 1) * self.tile_size]
+        sums = self.grid(z, 'values')[cells] if self.has_values else None
+        return self._colorize(self.grid(z)[cells], sums, z, cmap)
+
+    def level_for(self, xlim, width):
+        '''
+        :return: the coarsest level with at least one cell per pixel across xlim, when it is width pixels wide
+        '''
+        t = self._transform(np.asarray(xlim, dtype=float))
+        fraction = abs(t[1] - t[0]) / (self.meta['extent'][1] - self.meta['extent'][0])
+        cells = fraction * self.tile_size
+        z = int(np.ceil(np.log2(width / cells))) if cells > 0 else self.levels - 1
+        return min(max(z, 0), self.levels - 1)
+
+    def render(self, xlim=None, ylim=None, size=(1024, 768), cmap='gist_heat_r'):
+        '''
+        Draws a viewport from the level that matches its zoom, reading one cell per pixel.
+
+        :xlim: the (left, right) of the viewport in data coordinates (defaults to the whole pyramid)
+        :ylim: the (bottom, top) of the viewport
+        :size: the (width, height) in pixels
+        :return: a (height, width, 4) RGBA array
+        '''
+        x0, x1, y0, y1 = self.bounds
+        xlim, ylim = xlim or (x0, x1), ylim or (y0, y1)
+        width, height = size
+        z = self.level_for(xlim, width)
+        n = self.tile_size * 2 ** z
+        # the data coordinates at the centers of the pixels, from the top row down
+        tx = self._transform(np.asarray(xlim, dtype=float))
+        ty = self._transform(np.asarray(ylim, dtype=float))
+        px = tx[0] + (np.arange(width) + 0.5) / width * (tx[1] - tx[0])
+        py = ty[1] - (np.arange(height) + 0.5) / height * (ty[1] - ty[0])
+        cols, rows = _cells(px, py, self.meta['extent'], n)
+        inside_cols, inside_rows = (cols >= 0) & (cols < n), (rows >= 0) & (rows < n)
+        cells = np.ix_(np.clip(rows, 0, n - 1), np.clip(cols, 0, n - 1))
+        counts = np.asarray(self.grid(z)[cells])
+        counts[~(inside_rows[:, None] & inside_cols[None, :])] = 0
+        sums = np.asarray(self.grid(z, 'values')[cells]) if self.has_values else None
+        return self._colorize(counts, sums, z, cmap)
+
+    def _transform(self, values):
+        return aggregation._symlog(values) if self.log else values
+
+    def _colorize(self, counts, sums, z, cmap):
+        import matplotlib
+        colormap = matplotlib.colormaps[cmap]
+        if sums is None:
+            # log-scaled counts, so that sparse cells stay visible next to dense ones
+            shade = np.log1p(counts) / np.log1p(max(self.meta['max_counts'][z], 1))
+        else:
+            low, high = self.meta['value_range']
+            shade = (sums / np.maximum(counts, 1) - low) / ((high - low) or 1.)
+        rgba = colormap(shade, bytes=True)
+        rgba[..., 3] = np.where(counts > 0, 255, 0)
+        return rgba
+
+
+def fingerprint(pyramid):
+    '''
+    :return: the metadata of a pyramid (or of the pyramid in a directory), which changes
+             whenever it is rebuilt; render caches key pyramids by it
+    '''
+    directory = pyramid.directory if isinstance(pyramid, TilePyramid) else pyramid
+    with open(os.path.join(directory, 'pyramid.json'), 'rb') as f:
+        return f.read()
+
+
+def _aligned_chunks(columns, chunk_size):
+    '''
+    Yields the same chunk_size rows of every column at once. Columns are sliced without copying
+    (ChunkedArrays whatever their buffer boundaries), so only one chunk at a time is in memory.
+    '''
+    columns = [column if utils.is_column(column) else np.asarray(column) for column in columns]
+    if len({len(column) for column in columns}) > 1:
+        raise ValueError('x, y and values must have the same length.')
+    for start in range(0, len(columns[0]), chunk_size):
+        yield tuple(utils.as_array((column.iloc if hasattr(column, 'iloc') else column)[start:start + chunk_size]).ravel()
+                    for column in columns)
+
+
+def _open_grid(directory, z, name, dtype, n, mode):
+    return np.memmap(os.path.join(directory, 'level_{}.{}'.format(z, name)), dtype=dtype, mode=mode, shape=(n, n))
+
+
+def _cells(tx, ty, extent, n):
+    '''
+    :return: the column and row (counted from the top) of the cells of transformed points on an n x n grid
+    '''
+    col = np.floor((tx - extent[0]) / (extent[1] - extent[0]) * n).astype(np.intp)
+    row = n - 1 - np.floor((ty - extent[2]) / (extent[3] - extent[2]) * n).astype(np.intp)
+    # the points on the upper bounds belong to the last cells
+    col[col == n] = n - 1
+    row[row == -1] = 0
+    return col, row
+
+
+def _downsample(fine, coarse, block_rows=512):
+    '''
+    Sums every 2 x 2 block of cells of fine into coarse, a block of rows at a time.
+    '''
+    for start in range(0, len(coarse), block_rows):
+        rows = fine[2 * start:2 * (start + block_rows)]
+        summed = rows.reshape(len(rows) // 2, 2, coarse.shape[1], 2).sum(axis=(1, 3))
+        if coarse.dtype == np.uint32:
+            summed = np.minimum(summed, np.iinfo(np.uint32).max)
+        coarse[start:start + len(summed)] = summed
+    return coarse
+
+
+def _block_max(grid, block_rows=4096):
+    return max((np.max(grid[start:start + block_rows]) for start in range(0, len(grid), block_rows)), default=0)
+
+
+def tile_png(pyramid, z, tx, ty, cmap='gist_heat_r'):
+    '''
+    :return: a tile of the pyramid encoded as PNG bytes
+    '''
+    return _png(pyramid.tile(z, tx, ty, cmap))
+
+
+def _png(rgba):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+_VIEWER = '''<!doctype html>
+<title>tiles</title>
+<div>zoom <button onclick="zoom(-1)">-</button><button onclick="zoom(1)">+</button>
+pan <button onclick="pan(-1,0)">&larr;</button><button onclick="pan(1,0)">&rarr;</button>
+<button onclick="pan(0,-1)">&uarr;</button><button onclick="pan(0,1)">&darr;</button> <span id="where"></span></div>
+<div id="view" style="position:relative;width:{size}px;height:{size}px;background:#eee"></div>
+<script>
+var levels = {levels}, tile = {tile}, z = 0, x = 0, y = 0;
+function clamp(v) {{ return Math.max(0, Math.min(v, Math.max(0, (1 << z) - 3))); }}
+function draw() {{
+  var view = document.getElementById('view'); view.innerHTML = '';
+  for (var i = 0; i < 3; i++) for (var j = 0; j < 3; j++) {{
+    if (x + i >= (1 << z) || y + j >= (1 << z)) continue;
+    var img = document.createElement('img');
+    img.src = '/' + z + '/' + (x + i) + '/' + (y + j) + '.png';
+    img.style = 'position:absolute;left:' + i * tile + 'px;top:' + j * tile + 'px';
+    view.appendChild(img);
+  }}
+  document.getElementById('where').textContent = 'level ' + z + ', tiles from (' + x + ', ' + y + ')';
+}}
+function zoom(d) {{ var nz = Math.max(0, Math.min(levels - 1, z + d)); if (nz == z) return;
+  // keep the center of the view in place, clamped to the range of the new level
+  var nx = nz > z ? 2 * x + 1 : Math.floor((x - 1) / 2), ny = nz > z ? 2 * y + 1 : Math.floor((y - 1) / 2);
+  z = nz; x = clamp(nx); y = clamp(ny); draw(); }}
+function pan(dx, dy) {{ x = clamp(x + dx); y = clamp(y + dy); draw(); }}
+draw();
+</script>
+'''
+
+
+def serve(pyramid, host='127.0.0.1', port=8000, cmap='gist_heat_r'):
+    '''
+    Serves a pyramid over HTTP until interrupted: a small viewer at /, tiles at /z/x/y.png,
+    any viewport at /view.png?xlim=left,right&ylim=bottom,top&width=...&height=..., and the
+    pyramid's metadata at /pyramid.json.
+
+    :pyramid: a TilePyramid or the directory of one
+    '''
+    if not isinstance(pyramid, TilePyramid):
+        pyramid = TilePyramid(pyramid)
+    server = ThreadingHTTPServer((host, port), _handler(pyramid, cmap))
+    print('Serving {} at http://{}:{}/'.format(pyramid.directory, host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _handler(pyramid, cmap):
+    tile_path = re.compile(r'^/(\d+)/(\d+)/(\d+)\.png$')
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            try:
+                match = tile_path.match(url.path)
+                if match:
+                    self._send(tile_png(pyramid, *map(int, match.groups()), cmap=cmap), 'image/png')
+                elif url.path == '/view.png':
+                    query = {key: [float(v) for v in value[0].split(',')] for key, value in parse_qs(url.query).items()}
+                    size = (int(query.get('width', [1024])[0]), int(query.get('height', [768])[0]))
+                    self._send(_png(pyramid.render(query.get('xlim'), query.get('ylim'), size, cmap)), 'image/png')
+                elif url.path == '/pyramid.json':
+                    self._send(json.dumps(pyramid.meta).encode(), 'application/json')
+                elif url.path == '/':
+                    page = _VIEWER.format(levels=pyramid.levels, tile=pyramid.tile_size, size=3 * pyramid.tile_size)
+                    self._send(page.encode(), 'text/html')
+                else:
+                    self.send_error(404)
+            except ValueError as error:
+                self.send_error(400, str(error))
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def check_args(values_list, colors, alphas):
     if colors and len(colors) != len(values_list):
         print('There must be one color for each value.')
@@ -6,3 +9,64 @@ def check_args(values_list, colors, alphas):
         print('There must be one alpha for each value.')
         return False
     return True
+
+
+def is_column(values):
+    '''
+    :return: whether values is an array-like column (a NumPy array or memmap, an Arrow
+             Array or ChunkedArray or a pandas Series) rather than a list or an iterator
+    '''
+    return isinstance(values, np.ndarray) or hasattr(values, 'to_numpy')
+
+
+def is_chunked(values):
+    '''
+    :return: whether values lives outside of memory or in several buffers (a memmap or an
+             Arrow ChunkedArray), so that it is better processed chunk by chunk
+    '''
+    return isinstance(values, np.memmap) or type(values).__name__ == 'ChunkedArray'
+
+
+def as_array(values):
+    '''
+    Converts values to a NumPy array, without copying when it is already one (including
+    memmaps) or when it is an Arrow array or pandas Series over a compatible buffer.
+    Lists are converted with np.asarray, never element by element.
+    '''
+    if isinstance(values, np.ndarray):
+        return values
+    if type(values).__name__ == 'ChunkedArray':
+        chunks = [as_array(chunk) for chunk in values.chunks]
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks) if chunks else np.empty(0)
+    if hasattr(values, 'to_numpy'):
+        try:
+            return values.to_numpy(zero_copy_only=False) # pyarrow
+        except TypeError:
+            return values.to_numpy() # pandas
+    return np.asarray(values)
+
+
+def iter_chunks(values, chunk_size=1 << 20):
+    '''
+    Yields a column as NumPy arrays of at most chunk_size values. Arrays and memmaps are
+    sliced into views and Arrow ChunkedArrays are yielded buffer by buffer, so nothing is copied.
+    '''
+    chunks = values.chunks if type(values).__name__ == 'ChunkedArray' else [values]
+    for chunk in chunks:
+        chunk = as_array(chunk).ravel()
+        for start in range(0, len(chunk), chunk_size):
+            yield chunk[start:start + chunk_size]
+
+
+def read_parquet_column(path, column):
+    '''
+    Reads one column of a Parquet file as a memory-mapped Arrow ChunkedArray, which
+    every Plotter method accepts as data. Requires pyarrow.
+    '''
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Reading Parquet files requires pyarrow (pip install pyarrow).')
+    return pq.read_table(path, columns=[column], memory_map=True).column(column)